@@ -0,0 +1,73 @@
+"""Микробенчмарк клавиатур: сборка и сериализация на каждый ответ.
+
+"Без кэша" - разметка собирается заново (как раньше при каждом ответе),
+"с кэшем" - берется готовая из keyboards.py. В обоих случаях разметка
+сериализуется, как это делает aiogram при отправке.
+
+Запуск: python benchmarks/bench_keyboards.py --replies 20000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import keyboards
+
+
+def serialize(markup):
+    return markup.model_dump_json(exclude_none=True)
+
+
+def measure(func, replies):
+    started = time.perf_counter()
+    for _ in range(replies):
+        serialize(func())
+    return (time.perf_counter() - started) / replies * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replies", type=int, default=20_000)
+    parser.add_argument("--tasks", type=int, default=10, help="заданий в инлайн-клавиатуре")
+    args = parser.parse_args()
+
+    tasks = [
+        (i, f"Задание {i}", i % 10 + 1, i % 3 == 0, "2025-01-01 00:00:00")
+        for i in range(args.tasks)
+    ]
+    next_cursor = (tasks[-1][4], tasks[-1][0])
+    task_rows = (tuple(task[:4] for task in tasks), None, next_cursor)
+    children = ("djama", "ramz", "riza")
+
+    cases = [
+        (
+            "главное меню родителя",
+            lambda: keyboards.ReplyKeyboardMarkup(
+                keyboard=[[keyboards.KeyboardButton(text=button.text)] for [button] in keyboards.MAIN_PARENT_KEYBOARD.keyboard],
+                resize_keyboard=True,
+            ),
+            keyboards.get_main_parent_keyboard,
+        ),
+        (
+            "выбор ребенка",
+            lambda: keyboards._build_children_keyboard(children),
+            lambda: keyboards.get_children_keyboard(children),
+        ),
+        (
+            f"задания ({args.tasks} шт.)",
+            lambda: keyboards._build_tasks_keyboard(task_rows),
+            lambda: keyboards.get_tasks_keyboard(tasks, None, next_cursor),
+        ),
+    ]
+
+    print(f"Ответов: {args.replies}, время на ответ (мкс)")
+    for name, build, cached in cases:
+        before = measure(build, args.replies)
+        after = measure(cached, args.replies)
+        print(f"{name:28} без кэша {before:8.1f}   с кэшем {after:8.1f}   x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
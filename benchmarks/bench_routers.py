@@ -0,0 +1,231 @@
+"""Нагрузочный бенчмарк роутеров: синтетические апдейты без сети.
+
+Диспетчер собирается из роутеров main.py, Bot работает через подменную
+сессию, которая отвечает на запросы к Telegram API на месте. Апдейты
+(вход по паролю, "📋 Мои задания", нажатия complete:<id>, "📊 Статистика"
+и их смесь) подаются через Dispatcher.feed_raw_update на заполненную
+временную базу. Для каждого сценария выводятся пропускная способность
+и задержка обработки апдейта p50/p95/p99.
+
+Запуск: python benchmarks/bench_routers.py --tasks 20000 --updates 2000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message
+
+from bench_statistics import make_family, seed
+from database import AsyncDatabase, Database
+from keyboards import BTN_MY_TASKS, BTN_STATISTICS
+from main import create_dispatcher
+from utils.fsm_storage import create_storage
+
+TOKEN = "123456789:AAbenchmarkbenchmarkbenchmarkbench00"
+
+# Пароли участников семьи бенчмарка
+PASSWORDS = {
+    "parent": "bench-parent",
+    "djama": "bench-djama",
+    "ramz": "bench-ramz",
+    "riza": "bench-riza",
+}
+
+
+class MockSession(BaseSession):
+    """Сессия Bot без сети: считает вызовы методов и сразу отвечает"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = Counter()
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests[type(method).__name__] += 1
+        if isinstance(method, (SendMessage, EditMessageText)):
+            return Message(
+                message_id=self.requests.total(),
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id or 0, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class Updates:
+    """Фабрика сырых апдейтов в формате Bot API"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def message(self, user_id, text):
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }
+
+    def callback(self, user_id, data):
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "📋 Задания",
+                },
+            },
+        }
+
+
+async def feed(dp, bot, updates, concurrency):
+    """Подать апдейты не более чем по concurrency одновременно"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(update):
+        async with semaphore:
+            started = time.perf_counter()
+            await dp.feed_raw_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(process(update) for update in updates))
+    return time.perf_counter() - started, latencies
+
+
+def report(name, elapsed, latencies):
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100)
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+    print(
+        f"{name:14} {len(latencies):7} апд. {len(latencies) / elapsed:9.0f} апд/с   "
+        f"p50 {p50 * 1000:7.2f}   p95 {p95 * 1000:7.2f}   p99 {p99 * 1000:7.2f} мс"
+    )
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        family_id = make_family(database, PASSWORDS)
+        seed(database, family_id, args.tasks)
+        db = AsyncDatabase(database)
+        storage = create_storage(db)
+        session = MockSession()
+        bot = Bot(token=TOKEN, session=session)
+        dp = create_dispatcher(storage, db)
+        updates = Updates()
+
+        try:
+            # Пользователи по кругу: родитель и дети
+            roles = list(PASSWORDS)
+            users = {1000 + i: roles[i % len(roles)] for i in range(args.users)}
+            parents = [user_id for user_id, role in users.items() if role == "parent"]
+            children = [user_id for user_id, role in users.items() if role != "parent"]
+
+            # Открытые задания каждого ребенка для нажатий complete:<id>
+            open_tasks = {}
+            for child in database.get_all_children(family_id):
+                child_id = database.get_child_id(family_id, child)
+                task_ids = [task[0] for task in database.get_tasks(child_id)]
+                random.shuffle(task_ids)
+                open_tasks[child] = itertools.cycle(task_ids or [0])
+
+            def my_tasks():
+                return updates.message(random.choice(children), BTN_MY_TASKS)
+
+            def complete():
+                user_id = random.choice(children)
+                return updates.callback(user_id, f"complete:{next(open_tasks[users[user_id]])}")
+
+            def stats():
+                return updates.message(random.choice(parents), BTN_STATISTICS)
+
+            print(f"Заданий: {args.tasks}, пользователей: {args.users}, параллельно: {args.concurrency}")
+
+            # Вход: /start, семья с именем и пароль - по порядку для каждого пользователя
+            login = []
+            steps = (
+                lambda user_id: "/start",
+                lambda user_id: f"{family_id} {users[user_id]}",
+                lambda user_id: PASSWORDS[users[user_id]],
+            )
+            for step in steps:
+                elapsed, latencies = await feed(
+                    dp, bot, [updates.message(user_id, step(user_id)) for user_id in users], args.concurrency
+                )
+                login.append((elapsed, latencies))
+            report("вход", sum(e for e, _ in login), [lat for _, lats in login for lat in lats])
+
+            scenarios = [
+                ("мои задания", my_tasks),
+                ("complete", complete),
+                ("статистика", stats),
+            ]
+            for name, make in scenarios:
+                count = args.updates if name != "статистика" else max(1, args.updates // 10)
+                report(name, *await feed(dp, bot, [make() for _ in range(count)], args.concurrency))
+
+            # Смесь: статистика пересобирается после каждого выполнения задания
+            mixed = [random.choice((my_tasks, my_tasks, complete, stats))() for _ in range(args.updates)]
+            report("смесь", *await feed(dp, bot, mixed, args.concurrency))
+
+            print(f"Запросов к API: {dict(session.requests)}")
+        finally:
+            await storage.close()
+            await bot.session.close()
+            await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=20_000, help="заданий в базе")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=2_000, help="апдейтов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=1, help="апдейтов в обработке одновременно")
+    args = parser.parse_args()
+
+    random.seed(42)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Бенчмарк засева недельных заданий.
+
+Сравнивает прежнюю вставку по одному INSERT на задание с засевом
+Database.seed_weekly_tasks (executemany в одной транзакции) и замеряет
+повторный засев той же недели, который должен ничего не делать.
+
+Запуск: python benchmarks/bench_seeding.py --children 2000 --tasks 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Database
+
+
+def make_templates(children_count, tasks_count):
+    return {
+        f"child{c}": [{"text": f"Задание {i}", "stars": i % 10 + 1} for i in range(tasks_count)]
+        for c in range(children_count)
+    }
+
+
+def make_family(db, tasks_dict):
+    """Создать семью с детьми и их шаблонами, вернуть id семьи и id детей по именам"""
+    family_id = db.create_family("Бенчмарк")
+    conn = db._get_connection()
+    conn.executemany(
+        'INSERT INTO members (family_id, name, role) VALUES (?, ?, \'child\')',
+        ((family_id, child_name) for child_name in tasks_dict)
+    )
+    child_ids = {name: member_id for member_id, name, _ in db.get_members(family_id)}
+    conn.executemany(
+        'INSERT INTO weekly_templates (child_id, task_text, stars_reward) VALUES (?, ?, ?)',
+        (
+            (child_ids[child_name], task["text"], task["stars"])
+            for child_name, tasks in tasks_dict.items()
+            for task in tasks
+        )
+    )
+    conn.commit()
+    return family_id, child_ids
+
+
+def legacy_seed(db, child_ids, tasks_dict):
+    """Прежний засев: INSERT на каждое задание в цикле Python"""
+    conn = db._get_connection()
+    cursor = conn.cursor()
+    for child_name, tasks in tasks_dict.items():
+        for task in tasks:
+            cursor.execute(
+                'INSERT INTO tasks (child_id, child_name, task_text, stars_reward, is_weekly) VALUES (?, ?, ?, ?, ?)',
+                (child_ids[child_name], child_name, task["text"], task["stars"], True)
+            )
+    conn.commit()
+
+
+def keyed_loop_seed(db, child_ids, tasks_dict, week):
+    """Тот же засев с ключами, что и seed_weekly_tasks, но по одному INSERT"""
+    conn = db._get_connection()
+    cursor = conn.cursor()
+    for child_name, tasks in tasks_dict.items():
+        child_id = child_ids[child_name]
+        for i, task in enumerate(tasks):
+            cursor.execute(
+                '''INSERT OR IGNORE INTO tasks (child_id, child_name, task_text, stars_reward, is_weekly, seed_key)
+                VALUES (?, ?, ?, ?, ?, ?)''',
+                (child_id, child_name, task["text"], task["stars"], True, f"{week}:{child_id}:{i}")
+            )
+    conn.commit()
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--children", type=int, default=2000)
+    parser.add_argument("--tasks", type=int, default=10, help="шаблонов заданий на ребенка")
+    args = parser.parse_args()
+
+    templates = make_templates(args.children, args.tasks)
+    total = args.children * args.tasks
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = Database(os.path.join(tmp, "legacy.db"))
+        _, child_ids = make_family(legacy_db, templates)
+        legacy_time, _ = timed(legacy_seed, legacy_db, child_ids, templates)
+        legacy_db.close()
+
+        keyed_db = Database(os.path.join(tmp, "keyed.db"))
+        _, child_ids = make_family(keyed_db, templates)
+        keyed_time, _ = timed(keyed_loop_seed, keyed_db, child_ids, templates, "2025-W01")
+        keyed_db.close()
+
+        db = Database(os.path.join(tmp, "bulk.db"))
+        family_id, _ = make_family(db, templates)
+        bulk_time, added = timed(db.seed_weekly_tasks, family_id, "2025-W01")
+        again_time, again = timed(db.seed_weekly_tasks, family_id, "2025-W01")
+        db.close()
+
+    print(f"Детей: {args.children}, заданий: {total}")
+    # Уникальный индекс по ключу стоит места и времени, поэтому executemany
+    # сравнивается и с прежним засевом, и с тем же засевом с ключами в цикле
+    print(f"по одному INSERT      {legacy_time * 1000:9.1f} мс   (без ключей, как раньше)")
+    print(f"по одному с ключами   {keyed_time * 1000:9.1f} мс")
+    print(f"executemany           {bulk_time * 1000:9.1f} мс   добавлено {added}   x{keyed_time / bulk_time:.1f} к циклу с ключами")
+    print(f"повторный засев       {again_time * 1000:9.3f} мс   добавлено {again}")
+
+
+if __name__ == "__main__":
+    main()
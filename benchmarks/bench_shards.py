@@ -0,0 +1,101 @@
+"""Бенчмарк параллельной записи в шардированную базу.
+
+Много семей одновременно добавляют и выполняют задания через AsyncDatabase,
+как обработчики бота. Одна база (--shards 1) пропускает все записи через
+один поток и одну блокировку записи SQLite, у ShardedDatabase каждый шард
+пишет в своем потоке. Для каждого числа шардов выводится пропускная
+способность записей и раскладка семей по шардам.
+
+--synchronous FULL включает fsync на каждый commit, как на диске без
+кэша записи: тогда разница между шардами видна сильнее всего.
+
+Запуск: python benchmarks/bench_shards.py --families 200 --ops 4000 --shards 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import AsyncDatabase, Database
+from utils.shards import ShardedDatabase
+
+
+def create_families(db, families, children):
+    """Создать семьи, вернуть id всех детей"""
+    child_ids = []
+    for f in range(families):
+        family_id = db.create_family(f"Семья {f}")
+        for c in range(children):
+            child_ids.append(db.add_member(family_id, f"ребенок{c}"))
+    return child_ids
+
+
+async def write_load(db, child_ids, ops, concurrency):
+    """ops раз: задание случайному ребенку и выполнение его открытого задания
+    (две записи). Возвращает время и сумму начисленных звезд."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        child_id = random.choice(child_ids)
+        async with semaphore:
+            await db.add_task(child_id, f"Задание {i}", 1)
+            # Открытое задание могли выполнить параллельно: тогда начислено 0
+            task_id = (await db.get_tasks(child_id))[0][0]
+            return await db.complete_task(task_id, child_id)
+
+    started = time.perf_counter()
+    earned = await asyncio.gather(*(one(i) for i in range(ops)))
+    return time.perf_counter() - started, sum(earned)
+
+
+async def run(shards, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        sharded = ShardedDatabase(os.path.join(tmp, "bench.db"), shards=shards)
+        child_ids = create_families(sharded, args.families, args.children)
+        layout = Counter(sharded.shard_of_member(child_id) for child_id in child_ids[::args.children])
+        db = AsyncDatabase(sharded)
+        try:
+            elapsed, earned = await write_load(db, child_ids, args.ops, args.concurrency)
+            stars = sum(await asyncio.gather(*(db.get_child_stars(child_id) for child_id in child_ids)))
+            assert stars == earned, (stars, earned)
+        finally:
+            await db.close()
+    return elapsed, layout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--families", type=int, default=200)
+    parser.add_argument("--children", type=int, default=2, help="детей в семье")
+    parser.add_argument("--ops", type=int, default=4000, help="пар добавление+выполнение")
+    parser.add_argument("--concurrency", type=int, default=64, help="операций одновременно")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    args = parser.parse_args()
+
+    Database.PRAGMAS = tuple(
+        f"PRAGMA synchronous = {args.synchronous}" if pragma.startswith("PRAGMA synchronous") else pragma
+        for pragma in Database.PRAGMAS
+    )
+    print(f"Семей: {args.families}, операций: {args.ops}, параллельно: {args.concurrency}, "
+          f"synchronous = {args.synchronous}")
+    baseline = None
+    for shards in args.shards:
+        random.seed(42)
+        elapsed, layout = asyncio.run(run(shards, args))
+        # Две записи (add_task и complete_task) на операцию
+        rate = args.ops * 2 / elapsed
+        baseline = baseline or rate
+        spread = " ".join(f"{layout[i]}" for i in range(shards))
+        print(f"шардов {shards:3}: {rate:9.0f} записей/с   x{rate / baseline:.1f}   семей по шардам: {spread}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Бенчмарк Database.get_statistics на большой базе заданий.
+
+Сравнивает текущий запрос по журналу звезд с прежней схемой N+1
+(по несколько запросов на каждого ребенка).
+
+Запуск: python benchmarks/bench_statistics.py --tasks 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Database
+
+# Участники семьи бенчмарка
+MEMBERS = {"parent": "parent", "djama": "child", "ramz": "child", "riza": "child"}
+
+
+def make_family(db, passwords=None):
+    """Семья из MEMBERS, вернуть ее id (passwords - {имя: пароль})"""
+    passwords = passwords or {}
+    family_id = db.create_family("Бенчмарк")
+    for name, role in MEMBERS.items():
+        db.add_member(family_id, name, role, passwords.get(name))
+    return family_id
+
+
+def seed(db, family_id, tasks_count):
+    """Заполнить базу случайными заданиями и обнулениями детей семьи.
+
+    Журнал звезд и счетчики детей строятся по этой истории так же, как их
+    ведут complete_task и reset_child_stars.
+    """
+    conn = db._get_connection()
+    cursor = conn.cursor()
+    child_ids = [db.get_child_id(family_id, name) for name in db.get_all_children(family_id)]
+    names = {child_id: db.get_member(child_id)["name"] for child_id in child_ids}
+
+    rows = []
+    for i in range(tasks_count):
+        child_id = random.choice(child_ids)
+        completed = random.random() < 0.8
+        day = random.randint(1, 28)
+        rows.append((
+            child_id,
+            names[child_id],
+            f"Задание {i}",
+            random.randint(1, 10),
+            completed,
+            random.random() < 0.3,
+            f"2025-01-{day:02d} {random.randint(0, 23):02d}:00:00" if completed else None,
+        ))
+    cursor.executemany(
+        'INSERT INTO tasks (child_id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+
+    resets = {child_id: f"2025-01-{random.randint(1, 28):02d} 12:00:00" for child_id in child_ids}
+    cursor.executemany(
+        'INSERT INTO star_resets (child_id, child_name, reset_at) VALUES (?, ?, ?)',
+        [(child_id, names[child_id], reset_at) for child_id, reset_at in resets.items()]
+    )
+
+    completed_by_child = {child_id: [] for child_id in child_ids}
+    cursor.execute(
+        'SELECT id, child_id, stars_reward, completed_at FROM tasks WHERE is_completed = TRUE ORDER BY completed_at, id'
+    )
+    for task in cursor.fetchall():
+        completed_by_child[task[1]].append(task)
+
+    # Журнал: начисления до обнуления, само обнуление, начисления после него
+    earn = (
+        'INSERT INTO star_transactions (child_id, child_name, kind, amount, task_id, created_at) '
+        'VALUES (?, ?, \'earn\', ?, ?, ?)'
+    )
+    for child_id, tasks in completed_by_child.items():
+        name = names[child_id]
+        before = [task for task in tasks if task[3] <= resets[child_id]]
+        after = [task for task in tasks if task[3] > resets[child_id]]
+        cursor.executemany(earn, [(child_id, name, task[2], task[0], task[3]) for task in before])
+        cursor.execute(
+            'INSERT INTO star_transactions (child_id, child_name, kind, amount, created_at) '
+            'VALUES (?, ?, \'reset\', ?, ?)',
+            (child_id, name, -sum(task[2] for task in before), resets[child_id])
+        )
+        reset_tx = cursor.lastrowid
+        cursor.executemany(earn, [(child_id, name, task[2], task[0], task[3]) for task in after])
+        pending_stars = sum(task[2] for task in after)
+        cursor.execute(
+            'UPDATE members SET stars = ?, pending_count = ?, pending_stars = ?, last_reset_tx = ?, '
+            'completed_total = ? WHERE id = ?',
+            (pending_stars, len(after), pending_stars, reset_tx, len(tasks), child_id)
+        )
+    conn.commit()
+
+
+def legacy_active_completed_tasks(db, child_id):
+    """Прежний поиск выполненных заданий по времени последнего обнуления"""
+    cursor = db._get_connection().cursor()
+    last_reset = db.get_last_reset_time(child_id)
+    if last_reset:
+        cursor.execute(
+            '''SELECT * FROM tasks
+            WHERE child_id = ? AND is_completed = TRUE AND completed_at > ?
+            ORDER BY completed_at DESC''',
+            (child_id, last_reset)
+        )
+    else:
+        cursor.execute(
+            'SELECT * FROM tasks WHERE child_id = ? AND is_completed = TRUE ORDER BY completed_at DESC',
+            (child_id,)
+        )
+    return cursor.fetchall()
+
+
+def legacy_statistics(db, family_id):
+    """Прежняя реализация: отдельные запросы на каждого ребенка"""
+    cursor = db._get_connection().cursor()
+    stats = {"total_completed": 0, "total_pending": 0, "children": {}}
+    for child in db.get_all_children(family_id):
+        child_id = db.get_child_id(family_id, child)
+        active_completed = legacy_active_completed_tasks(db, child_id)
+        cursor.execute(
+            'SELECT COUNT(*) FROM tasks WHERE child_id = ? AND is_completed = FALSE',
+            (child_id,)
+        )
+        pending = cursor.fetchone()[0]
+        stats["children"][child] = {
+            "completed": len(active_completed),
+            "pending": pending,
+            "stars": db.get_child_stars(child_id),
+            "recent_tasks": active_completed[:5],
+        }
+        stats["total_completed"] += len(active_completed)
+        stats["total_pending"] += pending
+    return stats
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        family_id = make_family(db)
+        seed(db, family_id, args.tasks)
+
+        legacy = legacy_statistics(db, family_id)
+        current = db.get_statistics(family_id)
+        for child, child_stats in legacy["children"].items():
+            # Порядок заданий с одинаковым completed_at не определен, сравниваем счетчики
+            for key in ("completed", "pending", "stars"):
+                assert child_stats[key] == current["children"][child][key], (child, key)
+            assert len(child_stats["recent_tasks"]) == len(current["children"][child]["recent_tasks"])
+
+        legacy_best, legacy_avg = measure(lambda: legacy_statistics(db, family_id), args.repeat)
+        # Сам запрос, в обход кэша чтения (cached_read)
+        best, avg = measure(lambda: Database.get_statistics.__wrapped__(db, family_id), args.repeat)
+        db.close()
+
+    print(f"Заданий: {args.tasks}, повторов: {args.repeat}")
+    print(f"N+1 запросы:   min {legacy_best * 1000:8.2f} мс, avg {legacy_avg * 1000:8.2f} мс")
+    print(f"Один запрос:   min {best * 1000:8.2f} мс, avg {avg * 1000:8.2f} мс")
+    print(f"Ускорение:     x{legacy_avg / avg:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Нагрузочная проверка Database.complete_task на гонки.
+
+Много потоков (у каждого свое соединение) одновременно выполняют одни и те же
+задания по нескольку раз. В конце баланс каждого ребенка должен в точности
+совпасть с суммой наград его заданий, а каждое задание - засчитаться один раз.
+
+Запуск: python benchmarks/stress_complete_task.py --tasks 3000 --threads 32
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=3000)
+    parser.add_argument("--attempts", type=int, default=3, help="сколько раз выполняется каждое задание")
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "stress.db"))
+        family_id = db.create_family("Нагрузка")
+        children = [db.add_member(family_id, name) for name in ("djama", "ramz", "riza")]
+
+        expected = {child_id: 0 for child_id in children}
+        for i in range(args.tasks):
+            child_id = random.choice(children)
+            reward = random.randint(1, 10)
+            db.add_task(child_id, f"Задание {i}", reward)
+            expected[child_id] += reward
+
+        jobs = [(task[0], child_id) for child_id in children for task in db.get_tasks(child_id)] * args.attempts
+        random.shuffle(jobs)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            earned = list(pool.map(lambda job: db.complete_task(*job), jobs))
+        elapsed = time.perf_counter() - started
+
+        completions = sum(1 for stars in earned if stars > 0)
+        assert completions == args.tasks, f"засчитано {completions} из {args.tasks}"
+        assert sum(earned) == sum(expected.values())
+        for child, stars in expected.items():
+            assert db.get_child_stars(child) == stars, (child, db.get_child_stars(child), stars)
+        db.close()
+
+    print(f"Вызовов complete_task: {len(jobs)} в {args.threads} потоков за {elapsed:.2f} с")
+    print(f"Засчитано заданий: {completions}, звезды сходятся: {expected}")
+
+
+if __name__ == "__main__":
+    main()
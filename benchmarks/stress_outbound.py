@@ -0,0 +1,150 @@
+"""Нагрузочная проверка очереди исходящих сообщений (utils.outbound).
+
+Подменная сессия Bot ведет себя как Telegram под нагрузкой: больше
+chat_limit сообщений в чат или global_limit на бота за секунду - ответ
+429 с retry_after. Много "обработчиков" одновременно отвечают своим
+чатам пачками сообщений и часто правят одно и то же сообщение.
+
+Без очереди часть запросов падает с TelegramRetryAfter. С очередью все
+вызовы должны завершиться успешно, сообщения в каждом чате - прийти
+по порядку, а у каждого правленого сообщения остаться последний текст.
+
+Запуск: python benchmarks/stress_outbound.py --chats 100 --messages 5 --edits 10
+"""
+import argparse
+import asyncio
+import logging
+import math
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message
+
+from utils.outbound import OutboundQueue
+
+TOKEN = "123456789:AAbenchmarkbenchmarkbenchmarkbench00"
+
+
+class FloodSession(BaseSession):
+    """Сессия Bot без сети с лимитами Telegram и ответом 429 при превышении"""
+
+    def __init__(self, chat_limit=1, global_limit=30, window=1.0, latency=0.01):
+        super().__init__()
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.window = window
+        self.latency = latency
+        self._recent = deque()
+        self._recent_by_chat = defaultdict(deque)
+        self.requests = Counter()
+        # Что увидел пользователь: сообщения чатов по порядку и тексты правок
+        self.delivered = defaultdict(list)
+        self.texts = {}
+
+    def _retry_after(self, chat_id):
+        """0, если запрос укладывается в лимиты, иначе сколько секунд ждать"""
+        now = time.monotonic()
+        limits = ((self._recent, self.global_limit), (self._recent_by_chat[chat_id], self.chat_limit))
+        for sent, limit in limits:
+            while sent and sent[0] <= now - self.window:
+                sent.popleft()
+            if len(sent) >= limit:
+                # Telegram называет целое число секунд
+                return math.ceil(sent[0] + self.window - now)
+        for sent, _ in limits:
+            sent.append(now)
+        return 0
+
+    async def make_request(self, bot, method, timeout=None):
+        await asyncio.sleep(self.latency)
+        retry_after = self._retry_after(method.chat_id)
+        if retry_after:
+            self.requests["429"] += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=retry_after)
+
+        self.requests[type(method).__name__] += 1
+        if isinstance(method, SendMessage):
+            self.delivered[method.chat_id].append(method.text)
+        elif isinstance(method, EditMessageText):
+            self.texts[method.chat_id, method.message_id] = method.text
+        return Message(
+            message_id=method.message_id if isinstance(method, EditMessageText) else self.requests.total(),
+            date=datetime.now(),
+            chat=Chat(id=method.chat_id, type="private"),
+            text=method.text,
+        )
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+
+async def chat_load(bot, chat_id, messages, edits):
+    """Ответ одного "обработчика": пачка сообщений и быстрые правки одного из них"""
+    for i in range(messages):
+        await bot.send_message(chat_id, f"{chat_id}:{i}")
+    # Правки без ожидания друг друга, как при частых нажатиях кнопок
+    await asyncio.gather(*(
+        bot.edit_message_text(f"правка {i}", chat_id=chat_id, message_id=1)
+        for i in range(edits)
+    ))
+
+
+async def run(args, with_queue):
+    session = FloodSession(chat_limit=args.chat_limit, global_limit=args.global_limit)
+    queue = None
+    if with_queue:
+        queue = OutboundQueue(global_rate=args.global_limit, chat_rate=args.chat_limit, chat_burst=args.chat_limit)
+        session.middleware(queue)
+    bot = Bot(token=TOKEN, session=session)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(chat_load(bot, chat_id, args.messages, args.edits) for chat_id in range(1, args.chats + 1)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for result in results if isinstance(result, Exception))
+
+    name = "с очередью" if with_queue else "без очереди"
+    print(f"{name:12} {elapsed:7.2f} с   обработчиков с ошибкой: {failed:4}   ответов 429: {session.requests['429']:5}   "
+          f"отправлено: {session.requests['SendMessage']}, правок: {session.requests['EditMessageText']}")
+    if queue is not None:
+        print(f"{'':12} объединено правок: {queue.coalesced}, повторов после 429: {queue.flood_waits}")
+        assert failed == 0, "с очередью все вызовы должны завершиться"
+        for chat_id in range(1, args.chats + 1):
+            assert session.delivered[chat_id] == [f"{chat_id}:{i}" for i in range(args.messages)], chat_id
+            if args.edits:
+                assert session.texts[chat_id, 1] == f"правка {args.edits - 1}", chat_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=5, help="сообщений на чат")
+    parser.add_argument("--edits", type=int, default=10, help="правок одного сообщения на чат")
+    parser.add_argument("--chat-limit", type=int, default=1, help="сообщений в чат в секунду")
+    parser.add_argument("--global-limit", type=int, default=30, help="сообщений на бота в секунду")
+    args = parser.parse_args()
+
+    # Каждое ожидание по 429 пишется в лог, здесь их считает сама проверка
+    logging.getLogger("utils.outbound").setLevel(logging.ERROR)
+    print(f"Чатов: {args.chats}, сообщений: {args.messages}, правок: {args.edits} на чат")
+    asyncio.run(run(args, with_queue=False))
+    asyncio.run(run(args, with_queue=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
+import atexit
+import copy
+import gzip
+import json
 import os
 import logging
+import logging.handlers
+import queue
+import shutil
 import sys
 from pathlib import Path
-from datetime import datetime
 
 from dotenv import dotenv_values
 
@@ -24,26 +30,134 @@ PASSWORDS = {
     "riza": config.get("RIZA_PASSWORD")
 }
 
+# Число файлов-шардов SQLite с данными семей (1 - вся база в bot.db).
+# После увеличения семьи переносятся командой: python manage.py --shards N rebalance
+DB_SHARDS = int(config.get("DB_SHARDS", 1))
+
+# Хранилище состояний FSM: sqlite (в базе бота), memory или redis
+FSM_STORAGE = config.get("FSM_STORAGE", "sqlite")
+REDIS_URL = config.get("REDIS_URL", "redis://localhost:6379/0")
+# Через сколько секунд без активности незавершенный диалог забывается
+FSM_STATE_TTL = int(config.get("FSM_STATE_TTL", 24 * 60 * 60))
+
+# Режим запуска: polling или webhook (переопределяется флагом --mode)
+RUN_MODE = config.get("RUN_MODE", "polling")
+# Публичный https-адрес, на который Telegram будет слать апдейты
+WEBHOOK_URL = config.get("WEBHOOK_URL")
+WEBHOOK_PATH = config.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = config.get("WEBHOOK_SECRET")
+WEBHOOK_HOST = config.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(config.get("WEBHOOK_PORT", config.get("PORT", 8080)))
+# Сколько апдейтов обрабатывается одновременно
+WEBHOOK_MAX_CONCURRENCY = int(config.get("WEBHOOK_MAX_CONCURRENCY", 100))
+# Сколько параллельных соединений открывает Telegram (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(config.get("WEBHOOK_MAX_CONNECTIONS", 40))
+
+# Лимиты отправки сообщений Telegram: всего в секунду и в один чат в секунду
+OUTBOUND_RATE = float(config.get("OUTBOUND_RATE", 30))
+OUTBOUND_CHAT_RATE = float(config.get("OUTBOUND_CHAT_RATE", 1))
+
+# Сводки родителям о выполненных заданиях: через сколько секунд тишины
+# уходит сводка и сколько она может копиться самое большее
+NOTIFY_DELAY = float(config.get("NOTIFY_DELAY", 30))
+NOTIFY_MAX_DELAY = float(config.get("NOTIFY_MAX_DELAY", 300))
+
+# Обновление недельных заданий, формат cron "минута час * * день_недели"
+# (по умолчанию - понедельник 00:00 по местному времени)
+WEEKLY_TASKS_SCHEDULE = config.get("WEEKLY_TASKS_SCHEDULE", "0 0 * * 1")
+# Перенос старой истории в архив и сжатие базы (по умолчанию - ночью каждый день)
+ARCHIVE_SCHEDULE = config.get("ARCHIVE_SCHEDULE", "30 3 * * *")
+# Сколько дней история остается в рабочих таблицах
+ARCHIVE_KEEP_DAYS = int(config.get("ARCHIVE_KEEP_DAYS", 28))
+
+
+# Логи: text или json (JSON-строки в файле, в консоли - всегда текст)
+LOG_FORMAT = config.get("LOG_FORMAT", "text")
+# Сколько дней хранить сжатые логи прошлых дней
+LOG_BACKUP_DAYS = int(config.get("LOG_BACKUP_DAYS", 30))
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON (поля из extra= тоже попадают в нее)"""
+
+    # Стандартные атрибуты LogRecord: все остальные пришли из extra=
+    _RECORD_FIELDS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self._RECORD_FIELDS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладет в очередь копию записи с уже подставленными аргументами и
+    текстом исключения: aiogram и aiohttp логируют с %-аргументами и
+    exc_info, а к моменту записи в потоке объекты могут измениться.
+    Время, уровень и итоговый формат (text или json) - в потоке записи."""
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
 
 # Настройка логирования
 def setup_logging():
-    """Настройка системы логирования"""
+    """Настройка системы логирования.
+
+    Обработчики логгера только кладут запись в очередь, в файл и консоль
+    пишет фоновый поток QueueListener. Файл logs/bot.log в полночь
+    уходит в архив bot.log.ГГГГ-ММ-ДД.gz.
+    """
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
     
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        handlers=[
-            logging.FileHandler(f'logs/bot_{datetime.now().strftime("%Y%m%d")}.log', encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)
-        ]
+    text_formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    file_handler = logging.handlers.TimedRotatingFileHandler(
+        log_dir / "bot.log", when="midnight", backupCount=LOG_BACKUP_DAYS, encoding='utf-8'
     )
+    file_handler.namer = lambda name: name + ".gz"
+    file_handler.rotator = _gzip_rotator
+    file_handler.setFormatter(JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S') if LOG_FORMAT == "json" else text_formatter)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(text_formatter)
+    
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    # Остановка дописывает очередь: логи после выхода из main() тоже сохраняются
+    atexit.register(listener.stop)
+    
+    logging.basicConfig(level=logging.INFO, handlers=[_QueueHandler(log_queue)])
     
     # Уменьшаем шум от библиотек
     logging.getLogger('aiogram').setLevel(logging.WARNING)
     logging.getLogger('aiohttp').setLevel(logging.WARNING)
     logging.getLogger('asyncio').setLevel(logging.WARNING)
+    return listener
 
 logger = logging.getLogger("main")
@@ -1,18 +1,539 @@
+import asyncio
+import functools
+import hashlib
+import hmac
+import logging
+import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from default_tasks import WEEKLY_TASKS
+from utils.cache import LRUCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+def _backfill_star_ledger(cursor):
+    """Перенести историю начислений и обнулений в журнал звезд.
+
+    События воспроизводятся по времени, чтобы восстановить курсор последнего
+    обнуления и счетчики ожидающих награды заданий. Расхождение с текущим
+    children.stars записывается корректировкой.
+    """
+    # При равном времени начисление идет раньше обнуления: прежде задание
+    # считалось ожидающим, только если completed_at > reset_at
+    cursor.execute('''
+        SELECT child_name, completed_at, 0 AS is_reset, id, stars_reward
+        FROM tasks WHERE is_completed = TRUE
+        UNION ALL
+        SELECT child_name, reset_at, 1, NULL, 0
+        FROM star_resets
+        ORDER BY 2, 3
+    ''')
+    events = cursor.fetchall()
+    
+    ledger = {}
+    for child_name, at, is_reset, task_id, stars_reward in events:
+        state = ledger.setdefault(child_name, {"balance": 0, "count": 0, "stars": 0, "cursor": 0})
+        if is_reset:
+            cursor.execute(
+                'INSERT INTO star_transactions (child_name, kind, amount, created_at) VALUES (?, ?, ?, ?)',
+                (child_name, "reset", -state["balance"], at)
+            )
+            state.update(balance=0, count=0, stars=0, cursor=cursor.lastrowid)
+        else:
+            cursor.execute(
+                'INSERT INTO star_transactions (child_name, kind, amount, task_id, created_at) VALUES (?, ?, ?, ?, ?)',
+                (child_name, "earn", stars_reward, task_id, at)
+            )
+            state["balance"] += stars_reward
+            state["count"] += 1
+            state["stars"] += stars_reward
+    
+    cursor.execute('SELECT name, stars FROM children')
+    for child_name, stars in cursor.fetchall():
+        state = ledger.get(child_name, {"balance": 0, "count": 0, "stars": 0, "cursor": 0})
+        if stars != state["balance"]:
+            cursor.execute(
+                'INSERT INTO star_transactions (child_name, kind, amount) VALUES (?, ?, ?)',
+                (child_name, "adjust", stars - state["balance"])
+            )
+        cursor.execute(
+            'UPDATE children SET pending_count = ?, pending_stars = ?, last_reset_tx = ? WHERE name = ?',
+            (state["count"], state["stars"], state["cursor"], child_name)
+        )
+
+# Колонки задания, общие для tasks и tasks_archive
+_TASK_COLUMNS = 'id, child_id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at, seed_key'
+
+# Семья, в которую миграция перенесла детей и родителя из прежней схемы
+LEGACY_FAMILY_ID = 1
+
+def _backfill_weekly_templates(cursor):
+    """Шаблоны default_tasks.WEEKLY_TASKS - детям первой семьи с теми же именами"""
+    cursor.executemany(
+        '''INSERT INTO weekly_templates (child_id, task_text, stars_reward)
+        SELECT id, ?, ? FROM members WHERE family_id = ? AND name = ? AND role = 'child' ''',
+        (
+            (task["text"], task["stars"], LEGACY_FAMILY_ID, child_name)
+            for child_name, tasks in WEEKLY_TASKS.items()
+            for task in tasks
+        )
+    )
+
+def _migrate_legacy_family(cursor):
+    """Перенести детей прежней схемы в первую семью.
+
+    В новой базе детей нет и семья не создается: семьи заводят через
+    manage.py. id первой семьи все равно занимается, чтобы новой семье не
+    достались пароли из config.PASSWORDS.
+    """
+    cursor.execute('SELECT COUNT(*) FROM children')
+    if not cursor.fetchone()[0]:
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('families', ?)", (LEGACY_FAMILY_ID,))
+        return
+    cursor.execute("INSERT INTO families (id, name) VALUES (?, 'Семья')", (LEGACY_FAMILY_ID,))
+    cursor.execute(
+        '''INSERT INTO members (family_id, name, role, stars, pending_count, pending_stars,
+                                 last_reset_tx, completed_total, created_at)
+        SELECT ?, name, 'child', stars, pending_count, pending_stars,
+               last_reset_tx, completed_total, created_at
+        FROM children ORDER BY name''',
+        (LEGACY_FAMILY_ID,)
+    )
+    cursor.execute("INSERT INTO members (family_id, name, role) VALUES (?, 'parent', 'parent')", (LEGACY_FAMILY_ID,))
+
+# Параметры scrypt: ~70 мс и 16 МБ на проверку - перебор паролей дорог
+_SCRYPT_N, _SCRYPT_R, _SCRYPT_P = 2 ** 14, 8, 1
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=32, maxmem=64 * 1024 * 1024)
+
+def hash_password(password):
+    """Хэш пароля для members.password_hash: scrypt$n$r$p$соль$хэш"""
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, _SCRYPT_N, _SCRYPT_R, _SCRYPT_P)
+    return f"scrypt${_SCRYPT_N}${_SCRYPT_R}${_SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+def verify_password(password, stored):
+    """Совпадает ли пароль с хэшем. Медленная (scrypt): не вызывать в потоке базы
+    и в event loop."""
+    if not stored or not stored.startswith("scrypt$"):
+        return False
+    _, n, r, p, salt, digest = stored.split("$")
+    return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p)).hex(), digest)
+
+def _as_member(row):
+    """Участник семьи из строки (id, family_id, name, role)"""
+    if row is None:
+        return None
+    member_id, family_id, name, role = row
+    return {"id": member_id, "family_id": family_id, "name": name, "role": role}
+
+def cached_read(scope="child"):
+    """Кэшировать результат метода чтения до следующего изменения данных.
+    
+    Ключ - (метод, аргументы, версия данных семьи). scope говорит, что
+    передано первым аргументом: "child" - id ребенка, "family" - id семьи,
+    None - метод читает данные всех семей. Запись в одной семье не
+    сбрасывает кэш остальных. Результат отдается всем вызывающим общим
+    объектом, изменять его нельзя.
+    """
+    def decorator(method):
+        name = method.__name__
+        
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self._sync_external_writes()
+            family_id = None
+            if scope is not None:
+                key_id = args[0] if args else kwargs.get(f"{scope}_id")
+                family_id = self._family_of(key_id) if scope == "child" else key_id
+            key = (name, args, tuple(sorted(kwargs.items())), self._version_key(family_id))
+            result = self.read_cache.get(key)
+            if result is MISSING:
+                result = method(self, *args, **kwargs)
+                self.read_cache.set(key, result)
+            return result
+        
+        return wrapper
+    return decorator
+
+# Миграции схемы. Номер версии = позиция в списке + 1, текущая версия
+# хранится в PRAGMA user_version. Шаг миграции - SQL-строка или функция,
+# принимающая курсор. Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    # 1: индексы под горячие запросы заданий и обнулений
+    [
+        'CREATE INDEX IF NOT EXISTS idx_tasks_child_completed ON tasks (child_name, is_completed, completed_at)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_child_created ON tasks (child_name, is_completed, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_weekly ON tasks (is_weekly)',
+        'CREATE INDEX IF NOT EXISTS idx_star_resets_child ON star_resets (child_name, reset_at)',
+    ],
+    # 2: журнал звезд (earn / reset / adjust) и материализованные счетчики в children
+    [
+        '''CREATE TABLE IF NOT EXISTS star_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            child_name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            task_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_star_transactions_child ON star_transactions (child_name, id)',
+        # Выполненные после последнего обнуления задания: количество и сумма звезд
+        'ALTER TABLE children ADD COLUMN pending_count INTEGER DEFAULT 0',
+        'ALTER TABLE children ADD COLUMN pending_stars INTEGER DEFAULT 0',
+        # id записи журнала о последнем обнулении (0 - обнулений не было)
+        'ALTER TABLE children ADD COLUMN last_reset_tx INTEGER DEFAULT 0',
+        _backfill_star_ledger,
+    ],
+    # 3: состояния FSM aiogram (utils.fsm_storage.SQLiteStorage)
+    [
+        '''CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)',
+    ],
+    # 4: частичный индекс только по открытым заданиям для отчета родителя
+    [
+        'CREATE INDEX IF NOT EXISTS idx_tasks_open ON tasks (child_name, created_at DESC) WHERE is_completed = FALSE',
+    ],
+    # 5: счетчик выполненных за все время для сводки ребенка
+    [
+        'ALTER TABLE children ADD COLUMN completed_total INTEGER DEFAULT 0',
+        '''UPDATE children SET completed_total = (
+            SELECT COUNT(*) FROM star_transactions x WHERE x.child_name = children.name AND x.kind = 'earn'
+        )''',
+    ],
+    # 6: ключ идемпотентности недельных заданий и отметки засеянных недель
+    [
+        'ALTER TABLE tasks ADD COLUMN seed_key TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_seed_key ON tasks (seed_key) WHERE seed_key IS NOT NULL',
+        '''CREATE TABLE IF NOT EXISTS weekly_seeds (
+            week TEXT PRIMARY KEY,
+            seeded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    ],
+    # 7: время последнего запуска задач планировщика
+    [
+        '''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            last_run REAL NOT NULL
+        )''',
+    ],
+    # 8: архив истории заданий и обнулений, общие представления с архивом
+    [
+        '''CREATE TABLE IF NOT EXISTS tasks_archive (
+            id INTEGER PRIMARY KEY,
+            child_name TEXT,
+            task_text TEXT,
+            stars_reward INTEGER,
+            is_completed BOOLEAN,
+            is_weekly BOOLEAN,
+            completed_at TIMESTAMP,
+            created_at TIMESTAMP,
+            seed_key TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_archive_child ON tasks_archive (child_name, completed_at)',
+        '''CREATE TABLE IF NOT EXISTS star_resets_archive (
+            id INTEGER PRIMARY KEY,
+            child_name TEXT,
+            reset_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE VIEW IF NOT EXISTS tasks_history AS
+            SELECT id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at, seed_key
+            FROM tasks
+            UNION ALL
+            SELECT id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at, seed_key
+            FROM tasks_archive''',
+        '''CREATE VIEW IF NOT EXISTS star_resets_history AS
+            SELECT id, child_name, reset_at FROM star_resets
+            UNION ALL
+            SELECT id, child_name, reset_at FROM star_resets_archive''',
+    ],
+    # 9: семьи и их участники вместо фиксированного списка детей. Дети
+    # задаются id участника (child_id), child_name остается как имя для показа
+    [
+        '''CREATE TABLE IF NOT EXISTS families (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            family_id INTEGER NOT NULL REFERENCES families (id),
+            name TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'child',
+            password_hash TEXT,
+            stars INTEGER DEFAULT 0,
+            pending_count INTEGER DEFAULT 0,
+            pending_stars INTEGER DEFAULT 0,
+            last_reset_tx INTEGER DEFAULT 0,
+            completed_total INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_members_family_name ON members (family_id, name)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_members_password ON members (password_hash) WHERE password_hash IS NOT NULL',
+        # Прежние дети и родитель - первая семья, пароли приходят из config.PASSWORDS
+        _migrate_legacy_family,
+        'ALTER TABLE tasks ADD COLUMN child_id INTEGER',
+        'ALTER TABLE tasks_archive ADD COLUMN child_id INTEGER',
+        'ALTER TABLE star_resets ADD COLUMN child_id INTEGER',
+        'ALTER TABLE star_resets_archive ADD COLUMN child_id INTEGER',
+        'ALTER TABLE star_transactions ADD COLUMN child_id INTEGER',
+        'ALTER TABLE sessions ADD COLUMN member_id INTEGER',
+        *(
+            f'''UPDATE {table} SET {column} = (
+                SELECT m.id FROM members m WHERE m.family_id = {LEGACY_FAMILY_ID} AND m.name = {table}.{name_column}
+            )'''
+            for table, column, name_column in (
+                ("tasks", "child_id", "child_name"),
+                ("tasks_archive", "child_id", "child_name"),
+                ("star_resets", "child_id", "child_name"),
+                ("star_resets_archive", "child_id", "child_name"),
+                ("star_transactions", "child_id", "child_name"),
+                ("sessions", "member_id", "current_user"),
+            )
+        ),
+        # Индексы по имени ребенка заменяются индексами по child_id
+        'DROP INDEX IF EXISTS idx_tasks_child_completed',
+        'DROP INDEX IF EXISTS idx_tasks_child_created',
+        'DROP INDEX IF EXISTS idx_tasks_open',
+        'DROP INDEX IF EXISTS idx_star_resets_child',
+        'DROP INDEX IF EXISTS idx_star_transactions_child',
+        'DROP INDEX IF EXISTS idx_tasks_archive_child',
+        'CREATE INDEX idx_tasks_child_completed ON tasks (child_id, is_completed, completed_at)',
+        'CREATE INDEX idx_tasks_child_created ON tasks (child_id, is_completed, created_at)',
+        'CREATE INDEX idx_tasks_open ON tasks (child_id, created_at DESC) WHERE is_completed = FALSE',
+        'CREATE INDEX idx_star_resets_child ON star_resets (child_id, reset_at)',
+        'CREATE INDEX idx_star_transactions_child ON star_transactions (child_id, id)',
+        'CREATE INDEX idx_tasks_archive_child ON tasks_archive (child_id, completed_at)',
+        'DROP VIEW IF EXISTS tasks_history',
+        'DROP VIEW IF EXISTS star_resets_history',
+        f'''CREATE VIEW tasks_history AS
+            SELECT {_TASK_COLUMNS} FROM tasks
+            UNION ALL
+            SELECT {_TASK_COLUMNS} FROM tasks_archive''',
+        '''CREATE VIEW star_resets_history AS
+            SELECT id, child_id, child_name, reset_at FROM star_resets
+            UNION ALL
+            SELECT id, child_id, child_name, reset_at FROM star_resets_archive''',
+        # Засев недельных заданий - отдельно для каждой семьи
+        '''CREATE TABLE weekly_seeds_new (
+            family_id INTEGER NOT NULL,
+            week TEXT NOT NULL,
+            seeded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (family_id, week)
+        )''',
+        f'INSERT INTO weekly_seeds_new (family_id, week, seeded_at) SELECT {LEGACY_FAMILY_ID}, week, seeded_at FROM weekly_seeds',
+        'DROP TABLE weekly_seeds',
+        'ALTER TABLE weekly_seeds_new RENAME TO weekly_seeds',
+        'DROP TABLE children',
+    ],
+    # 10: в каком файле-шарде лежат данные семьи (utils.shards.ShardedDatabase);
+    # семьи без записи - в основной базе
+    [
+        '''CREATE TABLE IF NOT EXISTS family_shards (
+            family_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )''',
+    ],
+    # 11: вошедшие участники семьи - для уведомлений родителям
+    [
+        'CREATE INDEX IF NOT EXISTS idx_sessions_member ON sessions (member_id)',
+    ],
+    # 12: шаблоны недельных заданий у каждого ребенка вместо общего словаря
+    # по именам; прежние шаблоны из default_tasks получает первая семья
+    [
+        '''CREATE TABLE IF NOT EXISTS weekly_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            child_id INTEGER NOT NULL,
+            task_text TEXT NOT NULL,
+            stars_reward INTEGER NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_weekly_templates_child ON weekly_templates (child_id)',
+        _backfill_weekly_templates,
+    ],
+    # 13: вход по номеру семьи и имени, пароли больше не уникальны среди всех семей.
+    # Хэши не scrypt сбрасываются: пароли первой семьи заново задаются из конфигурации
+    [
+        'DROP INDEX IF EXISTS idx_members_password',
+        "UPDATE members SET password_hash = NULL WHERE password_hash NOT LIKE 'scrypt$%'",
+    ],
+]
+
+def _move_to_archive(conn, table, where, params=(), batch_size=None):
+    """Перенести строки table, подходящие под where, в архив table_archive.
+
+    С batch_size перенос идет пачками по отдельной транзакции на каждую,
+    чтобы не держать блокировку записи долго; без него - в текущей
+    транзакции одним запросом. Возвращает число перенесенных строк.
+    """
+    columns = _TASK_COLUMNS if table == "tasks" else "id, child_id, child_name, reset_at"
+    cursor = conn.cursor()
+    
+    if batch_size is None:
+        cursor.execute(f'INSERT INTO {table}_archive ({columns}) SELECT {columns} FROM {table} WHERE {where}', params)
+        cursor.execute(f'DELETE FROM {table} WHERE {where}', params)
+        return cursor.rowcount
+    
+    moved = 0
+    while True:
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute(f'SELECT id FROM {table} WHERE {where} LIMIT ?', (*params, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if ids:
+                marks = ",".join("?" * len(ids))
+                cursor.execute(
+                    f'INSERT INTO {table}_archive ({columns}) SELECT {columns} FROM {table} WHERE id IN ({marks})',
+                    ids
+                )
+                cursor.execute(f'DELETE FROM {table} WHERE id IN ({marks})', ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
+
+def current_week(now=None):
+    """ISO-неделя вида 2025-W07 - ключ засева недельных заданий"""
+    year, week, _ = (now or datetime.now()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
 class Database:
-    def __init__(self, db_path="bot.db"):
+    # Прагмы применяются один раз при открытии соединения
+    PRAGMAS = (
+        # Действует только для новой базы (до WAL и первых таблиц): тогда
+        # compact() не нужен полный VACUUM, чтобы включить этот режим
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -16000",      # ~16 МБ страничного кэша
+        "PRAGMA mmap_size = 134217728",    # 128 МБ memory-mapped I/O
+        "PRAGMA temp_store = MEMORY",
+    )
+
+    def __init__(self, db_path="bot.db", session_cache_size=10000, session_ttl=300, read_cache_size=4096, events=None):
         self.db_path = db_path
+        # Шина событий (utils.events.EventBus): о выполнении заданий и наградах
+        self.events = events
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # Сессии меняются только при входе и выходе, а читаются на каждом апдейте.
+        # Запись другого процесса (другого воркера webhook) сбрасывает кэш
+        # целиком, см. _sync_external_writes; TTL - дополнительная страховка.
+        self.session_cache = LRUCache(maxsize=session_cache_size, ttl=session_ttl)
+        # Версии данных для кэшей чтения: data_version растет при любом изменении
+        # заданий и звезд, версия семьи - при изменениях только в этой семье,
+        # _epoch - при изменениях, затрагивающих все семьи сразу
+        self.data_version = 0
+        self._epoch = 0
+        self._family_versions = {}
+        # id участника -> id семьи; участники не переходят между семьями
+        self._member_families = {}
+        self.read_cache = LRUCache(maxsize=read_cache_size)
         self.init_db()
     
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """Долгоживущее соединение текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False только ради close() из главного потока,
+            # каждое соединение используется одним потоком
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    def _bump_version(self, family_id=None):
+        """Отметить изменение данных семьи (None - всех семей)"""
+        with self._lock:
+            self.data_version += 1
+            if family_id is None:
+                self._epoch += 1
+            else:
+                self._family_versions[family_id] = self._family_versions.get(family_id, 0) + 1
+    
+    def _version_key(self, family_id=None):
+        if family_id is None:
+            return self.data_version
+        return self._epoch, self._family_versions.get(family_id, 0)
+    
+    def _family_of(self, member_id):
+        """id семьи участника (None, если участника нет)"""
+        if member_id is None:
+            return None
+        family_id = self._member_families.get(member_id)
+        if family_id is None:
+            cursor = self._get_connection().cursor()
+            cursor.execute('SELECT family_id FROM members WHERE id = ?', (member_id,))
+            result = cursor.fetchone()
+            if result:
+                family_id = self._member_families[member_id] = result[0]
+        return family_id
+    
+    def _publish(self, event_type, child_id, **data):
+        """Опубликовать событие ребенка после коммита, если шина подключена"""
+        if self.events is not None:
+            self.events.publish({"type": event_type, "family_id": self._family_of(child_id), "child_id": child_id, **data})
+    
+    def _sync_external_writes(self):
+        """Сбросить версии и кэш сессий, если базу изменило другое соединение (другой процесс)"""
+        version = self._get_connection().execute('PRAGMA data_version').fetchone()[0]
+        seen = getattr(self._local, "pragma_data_version", None)
+        self._local.pragma_data_version = version
+        if seen is not None and seen != version:
+            self._bump_version()
+            # Какие сессии поменялись, не известно: вход в другом воркере
+            # должен быть виден здесь сразу, а не через TTL
+            self.session_cache.clear()
+    
+    def current_data_version(self):
+        """Текущая data_version с учетом записей других процессов"""
+        self._sync_external_writes()
+        return self.data_version
+    
+    def family_version(self, family_id):
+        """Версия данных семьи с учетом записей других процессов"""
+        self._sync_external_writes()
+        return self._version_key(family_id)
+    
+    def close(self):
+        """Закрыть все открытые соединения"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
     
     def init_db(self):
         conn = self._get_connection()
         cursor = conn.cursor()
         
+        # Исходная схема нужна только новой базе: дальше ее меняют миграции
+        # (в частности, children заменена таблицей members)
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] == 0:
+            self._create_base_schema(cursor)
+            conn.commit()
+        self._migrate(conn)
+    
+    def _create_base_schema(self, cursor):
         # Таблица детей
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS children (
@@ -53,163 +574,557 @@ class Database:
                 reset_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        
-        # Инициализируем детей
-        children = ["djama", "ramz", "riza"]
-        for child_name in children:
-            cursor.execute(
-                'INSERT OR IGNORE INTO children (name, stars) VALUES (?, ?)',
-                (child_name, 0)
-            )
-        
-        conn.commit()
-        conn.close()
+    
+    def _migrate(self, conn):
+        """Применить недостающие миграции схемы"""
+        for version, steps in enumerate(MIGRATIONS, start=1):
+            # BEGIN IMMEDIATE берет блокировку записи, поэтому версию
+            # перепроверяем уже под ней: другой процесс мог успеть первым
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = conn.execute('PRAGMA user_version').fetchone()[0]
+                if current >= version:
+                    conn.rollback()
+                    continue
+                
+                cursor = conn.cursor()
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
     
     # СЕССИИ
-    def set_current_user(self, telegram_id, user_name):
+    def set_current_user(self, telegram_id, member_id):
+        """Привязать пользователя Telegram к участнику семьи (None - выход)"""
         conn = self._get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            'INSERT OR REPLACE INTO sessions (telegram_id, current_user) VALUES (?, ?)',
-            (telegram_id, user_name)
+            'INSERT OR REPLACE INTO sessions (telegram_id, member_id) VALUES (?, ?)',
+            (telegram_id, member_id)
         )
         conn.commit()
-        conn.close()
+        self.session_cache.set(telegram_id, self.get_member(member_id) if member_id else None)
     
     def get_current_user(self, telegram_id):
+        """Участник семьи текущей сессии: {"id", "family_id", "name", "role"} или None"""
+        self._sync_external_writes()
+        member = self.session_cache.get(telegram_id)
+        if member is not MISSING:
+            return member
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT m.id, m.family_id, m.name, m.role FROM sessions s
+            JOIN members m ON m.id = s.member_id
+            WHERE s.telegram_id = ?''',
+            (telegram_id,)
+        )
+        member = _as_member(cursor.fetchone())
+        self.session_cache.set(telegram_id, member)
+        return member
+    
+    def get_parent_sessions(self, family_id):
+        """telegram_id пользователей, вошедших как родители семьи"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT s.telegram_id FROM members m
+            JOIN sessions s ON s.member_id = m.id
+            WHERE m.family_id = ? AND m.role = 'parent' ''',
+            (family_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    # СЕМЬИ
+    def create_family(self, name, family_id=None):
+        """Создать семью, вернуть ее id (family_id задает id явно - для шардов)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO families (id, name) VALUES (?, ?)', (family_id, name))
+        conn.commit()
+        return cursor.lastrowid
+    
+    def get_family_ids(self):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM families ORDER BY id')
+        return [row[0] for row in cursor.fetchall()]
+    
+    def get_local_family_ids(self):
+        """Семьи, чьи задания лежат в этом файле (в основной базе - кроме
+        перенесенных в другие шарды)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id FROM families WHERE id NOT IN (SELECT family_id FROM family_shards WHERE shard != 0) ORDER BY id'
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    def get_families(self):
+        """Все семьи: (id, название, участников)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT f.id, f.name, COUNT(m.id) FROM families f
+            LEFT JOIN members m ON m.family_id = f.id
+            GROUP BY f.id ORDER BY f.id'''
+        )
+        return cursor.fetchall()
+    
+    def add_member(self, family_id, name, role="child", password=None, member_id=None):
+        """Добавить участника семьи (role - "child" или "parent"), вернуть его id"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO members (id, family_id, name, role, password_hash) VALUES (?, ?, ?, ?, ?)',
+            (member_id, family_id, name.lower(), role, hash_password(password) if password else None)
+        )
+        conn.commit()
+        self._bump_version(family_id)
+        return cursor.lastrowid
+    
+    def get_member(self, member_id):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, family_id, name, role FROM members WHERE id = ?', (member_id,))
+        return _as_member(cursor.fetchone())
+    
+    def get_members(self, family_id):
+        """Участники семьи: (id, имя, роль)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, name, role FROM members WHERE family_id = ? ORDER BY name', (family_id,))
+        return cursor.fetchall()
+    
+    def set_member_password(self, member_id, password):
+        """Задать пароль участника"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'UPDATE members SET password_hash = ? WHERE id = ?',
+            (hash_password(password) if password else None, member_id)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    
+    def set_family_passwords(self, family_id, passwords):
+        """Задать пароли участников семьи по именам: {имя: пароль}"""
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT current_user FROM sessions WHERE telegram_id = ?', (telegram_id,))
+        cursor.executemany(
+            'UPDATE members SET password_hash = ? WHERE family_id = ? AND name = ?',
+            [
+                (hash_password(password), family_id, name)
+                for name, password in passwords.items()
+                if password
+            ]
+        )
+        conn.commit()
+    
+    def get_login(self, family_id, name):
+        """Участник семьи по имени и хэш его пароля: (участник, хэш) или None.
+        
+        Пароль проверяется вызывающим (verify_password) вне потока базы.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, family_id, name, role, password_hash FROM members WHERE family_id = ? AND name = ?',
+            (family_id, name.lower())
+        )
+        row = cursor.fetchone()
+        if row is None or row[4] is None:
+            return None
+        return _as_member(row[:4]), row[4]
+    
+    @cached_read(scope="family")
+    def get_all_children(self, family_id):
+        """Имена детей семьи"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT name FROM members WHERE family_id = ? AND role = 'child' ORDER BY name",
+            (family_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    @cached_read(scope="family")
+    def get_child_id(self, family_id, child_name):
+        """id ребенка семьи по имени (None, если такого нет)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id FROM members WHERE family_id = ? AND name = ? AND role = 'child'",
+            (family_id, child_name)
+        )
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
     
-    def get_all_children(self):
-        """Получить всех детей"""
-        return ["djama", "ramz", "riza"]
+    @cached_read(scope="family")
+    def get_children_stars(self, family_id):
+        """Дети семьи с балансом: (имя, звезды)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT name, stars FROM members WHERE family_id = ? AND role = 'child' ORDER BY name",
+            (family_id,)
+        )
+        return cursor.fetchall()
+    
+    # СОСТОЯНИЯ FSM
+    def get_fsm_record(self, key):
+        """Получить (state, data, updated_at) по ключу FSM"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,))
+        return cursor.fetchone()
+    
+    def save_fsm_records(self, records):
+        """Сохранить пачку записей (key, state, data, updated_at) одной транзакцией"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        # Пустые состояния (после state.clear()) не храним
+        empty = [(key,) for key, state, data, _ in records if state is None and data == '{}']
+        filled = [record for record in records if record[1] is not None or record[2] != '{}']
+        cursor.executemany('DELETE FROM fsm_states WHERE key = ?', empty)
+        cursor.executemany(
+            'INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+            filled
+        )
+        conn.commit()
+    
+    def delete_expired_fsm_records(self, before):
+        """Удалить состояния, не менявшиеся с момента before (unix time)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM fsm_states WHERE updated_at < ?', (before,))
+        conn.commit()
+        return cursor.rowcount
     
     # ДЕТИ И ЗВЕЗДЫ
-    def get_child_stars(self, child_name):
+    @cached_read()
+    def get_child_stars(self, child_id):
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT stars FROM children WHERE name = ?', (child_name,))
+        cursor.execute('SELECT stars FROM members WHERE id = ?', (child_id,))
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else 0
     
-    def reset_child_stars(self, child_name):
+    def reset_child_stars(self, child_id):
         """Обнулить звезды ребенка и запомнить время обнуления"""
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        # Записываем время обнуления
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT name, stars FROM members WHERE id = ?', (child_id,))
+            child = cursor.fetchone()
+            
+            # Записываем время обнуления
+            cursor.execute(
+                'INSERT INTO star_resets (child_id, child_name) SELECT id, name FROM members WHERE id = ?',
+                (child_id,)
+            )
+            
+            # Списание всего баланса в журнал, его id - новый курсор обнуления
+            cursor.execute(
+                '''INSERT INTO star_transactions (child_id, child_name, kind, amount)
+                SELECT id, name, 'reset', -stars FROM members WHERE id = ?''',
+                (child_id,)
+            )
+            
+            # Обнуляем звезды
+            cursor.execute(
+                '''UPDATE members SET stars = 0, pending_count = 0, pending_stars = 0, last_reset_tx = ?
+                WHERE id = ?''',
+                (cursor.lastrowid, child_id)
+            )
+            
+            conn.commit()
+        except Exception:
+            # Соединение потока долгоживущее: незакрытая транзакция сломала бы все следующие
+            conn.rollback()
+            raise
+        
+        self._bump_version(self._family_of(child_id))
+        if child:
+            self._publish("stars_reset", child_id, child_name=child[0], stars=child[1])
+        return True
+    
+    @cached_read()
+    def get_child_summary(self, child_id):
+        """Сводка ребенка для экрана "Мои звезды" одним запросом.
+        
+        stars - баланс, total_completed - выполнено за все время, open - ждут
+        выполнения, pending_count/pending_stars - выполнены и ждут награды,
+        recent_tasks - 5 последних из ожидающих награды.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
         cursor.execute(
-            'INSERT INTO star_resets (child_name) VALUES (?)',
-            (child_name,)
+            '''SELECT c.stars, c.completed_total,
+                   (SELECT COUNT(*) FROM tasks t
+                    WHERE t.child_id = c.id AND t.is_completed = FALSE),
+                   c.pending_count, c.pending_stars,
+                   r.id, r.child_name, r.task_text, r.stars_reward, r.is_completed, r.is_weekly, r.completed_at, r.created_at
+            FROM members c
+            LEFT JOIN tasks r ON r.id IN (
+                SELECT x.task_id FROM star_transactions x
+                WHERE x.child_id = c.id AND x.id > c.last_reset_tx AND x.kind = 'earn'
+                ORDER BY x.id DESC
+                LIMIT 5
+            )
+            WHERE c.id = ?
+            ORDER BY r.completed_at DESC, r.id DESC''',
+            (child_id,)
         )
+        rows = cursor.fetchall()
         
-        # Обнуляем звезды
-        cursor.execute('UPDATE children SET stars = 0 WHERE name = ?', (child_name,))
-        
-        conn.commit()
-        conn.close()
-        return True
+        summary = {
+            "stars": 0,
+            "total_completed": 0,
+            "open": 0,
+            "pending_count": 0,
+            "pending_stars": 0,
+            "recent_tasks": []
+        }
+        if rows:
+            stars, total_completed, open_count, pending_count, pending_stars = rows[0][:5]
+            summary.update(
+                stars=stars,
+                total_completed=total_completed,
+                open=open_count,
+                pending_count=pending_count,
+                pending_stars=pending_stars,
+                recent_tasks=[row[5:] for row in rows if row[5] is not None]
+            )
+        return summary
     
-    def get_last_reset_time(self, child_name):
+    @cached_read()
+    def get_last_reset_time(self, child_id):
         """Получить время последнего обнуления звезд"""
         conn = self._get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT reset_at FROM star_resets WHERE child_name = ? ORDER BY reset_at DESC LIMIT 1',
-            (child_name,)
+            'SELECT reset_at FROM star_resets WHERE child_id = ? ORDER BY reset_at DESC LIMIT 1',
+            (child_id,)
         )
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
     
     # ЗАДАНИЯ
-    def add_task(self, child_name, task_text, stars_reward, is_weekly=False):
+    def add_task(self, child_id, task_text, stars_reward, is_weekly=False):
         conn = self._get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            'INSERT INTO tasks (child_name, task_text, stars_reward, is_weekly) VALUES (?, ?, ?, ?)',
-            (child_name, task_text, stars_reward, is_weekly)
+            '''INSERT INTO tasks (child_id, child_name, task_text, stars_reward, is_weekly)
+            SELECT id, name, ?, ?, ? FROM members WHERE id = ?''',
+            (task_text, stars_reward, is_weekly, child_id)
         )
         conn.commit()
-        conn.close()
+        self._bump_version(self._family_of(child_id))
     
-    def add_tasks_for_all_children(self, tasks_dict):
-        """Добавить задания для всех детей"""
+    def seed_weekly_tasks(self, family_id, week=None):
+        """Засеять детям семьи задания из их недельных шаблонов один раз за неделю.
+        
+        Возвращает число добавленных заданий; 0, если неделя уже засеяна;
+        None, если у семьи нет шаблонов (неделя тогда не отмечается).
+        Повторный засев останавливается на одной проверке weekly_seeds,
+        а ключ задания (неделя:id ребенка:id шаблона) с уникальным индексом
+        не дает задвоить задания, даже если отметки недели нет.
+        """
+        week = week or current_week()
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        for child_name, tasks in tasks_dict.items():
-            for task in tasks:
-                cursor.execute(
-                    'INSERT INTO tasks (child_name, task_text, stars_reward, is_weekly) VALUES (?, ?, ?, ?)',
-                    (child_name, task["text"], task["stars"], True)
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(
+                'SELECT 1 FROM weekly_seeds WHERE family_id = ? AND week = ?',
+                (family_id, week)
+            )
+            if cursor.fetchone():
+                conn.rollback()
+                return 0
+            
+            cursor.execute(
+                '''SELECT m.id, m.name, w.id, w.task_text, w.stars_reward FROM members m
+                JOIN weekly_templates w ON w.child_id = m.id
+                WHERE m.family_id = ? AND m.role = 'child' ''',
+                (family_id,)
+            )
+            templates = cursor.fetchall()
+            if not templates:
+                conn.rollback()
+                return None
+            
+            cursor.execute(
+                'INSERT INTO weekly_seeds (family_id, week) VALUES (?, ?)',
+                (family_id, week)
+            )
+            cursor.executemany(
+                '''INSERT OR IGNORE INTO tasks (child_id, child_name, task_text, stars_reward, is_weekly, seed_key)
+                VALUES (?, ?, ?, ?, TRUE, ?)''',
+                (
+                    (child_id, child_name, task_text, stars_reward, f"{week}:{child_id}:{template_id}")
+                    for child_id, child_name, template_id, task_text, stars_reward in templates
                 )
+            )
+            added = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
         
+        self._bump_version(family_id)
+        return added
+    
+    # ШАБЛОНЫ НЕДЕЛЬНЫХ ЗАДАНИЙ
+    def add_weekly_template(self, child_id, task_text, stars_reward):
+        """Добавить ребенку шаблон недельного задания, вернуть его id"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''INSERT INTO weekly_templates (child_id, task_text, stars_reward)
+            SELECT id, ?, ? FROM members WHERE id = ? AND role = 'child' ''',
+            (task_text, stars_reward, child_id)
+        )
         conn.commit()
-        conn.close()
+        if cursor.rowcount == 0:
+            return None
+        self._bump_version(self._family_of(child_id))
+        return cursor.lastrowid
     
-    def get_tasks(self, child_name=None, completed=False):
+    @cached_read(scope="family")
+    def get_weekly_templates(self, family_id):
+        """Шаблоны недельных заданий семьи: (id, имя ребенка, текст, звезды)"""
         conn = self._get_connection()
         cursor = conn.cursor()
-        
-        if child_name:
-            cursor.execute(
-                'SELECT * FROM tasks WHERE child_name = ? AND is_completed = ? ORDER BY created_at DESC',
-                (child_name, completed)
-            )
-        else:
-            cursor.execute(
-                'SELECT * FROM tasks WHERE is_completed = ? ORDER BY created_at DESC',
-                (completed,)
-            )
+        cursor.execute(
+            '''SELECT w.id, m.name, w.task_text, w.stars_reward FROM members m
+            JOIN weekly_templates w ON w.child_id = m.id
+            WHERE m.family_id = ?
+            ORDER BY m.name, w.id''',
+            (family_id,)
+        )
+        return cursor.fetchall()
+    
+    def delete_weekly_template(self, family_id, template_id):
+        """Удалить шаблон недельного задания семьи"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''DELETE FROM weekly_templates
+            WHERE id = ? AND child_id IN (SELECT id FROM members WHERE family_id = ?)''',
+            (template_id, family_id)
+        )
+        conn.commit()
+        self._bump_version(family_id)
+        return cursor.rowcount > 0
+    
+    @cached_read()
+    def get_tasks(self, child_id, completed=False):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at FROM tasks WHERE child_id = ? AND is_completed = ? ORDER BY created_at DESC',
+            (child_id, completed)
+        )
         
         tasks = cursor.fetchall()
-        conn.close()
         return tasks
     
-    def get_active_completed_tasks(self, child_name=None):
-        """Получить выполненные задания, за которые еще не рассчитались"""
+    def iter_open_tasks(self, family_id):
+        """Открытые задания детей семьи по одному: (child_name, task_text, stars_reward).
+        
+        Строки читаются из курсора по мере перебора, весь список в памяти
+        не собирается. Сгруппированы по ребенку, новые сверху.
+        """
+        cursor = self._get_connection().cursor()
+        cursor.execute(
+            '''SELECT m.name, t.task_text, t.stars_reward FROM members m
+            JOIN tasks t ON t.child_id = m.id AND t.is_completed = FALSE
+            WHERE m.family_id = ? AND m.role = 'child'
+            ORDER BY m.name, t.created_at DESC''',
+            (family_id,)
+        )
+        yield from cursor
+    
+    @cached_read()
+    def get_tasks_page(self, child_id, before=None, after=None, limit=10):
+        """Страница открытых заданий ребенка, новые сверху.
+        
+        Keyset-пагинация по (created_at, id): before - курсор последней строки
+        предыдущей страницы (листаем дальше), after - курсор первой строки
+        следующей (листаем назад). Возвращает (задания, курсор назад, курсор
+        вперед); курсор None, если листать в эту сторону некуда. Задание -
+        кортеж (id, task_text, stars_reward, is_weekly, created_at).
+        """
         conn = self._get_connection()
         cursor = conn.cursor()
+        columns = 'id, task_text, stars_reward, is_weekly, created_at'
         
-        if child_name:
-            # Для конкретного ребенка
-            last_reset = self.get_last_reset_time(child_name)
-            if last_reset:
-                # Берем задания выполненные ПОСЛЕ последнего обнуления
+        # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+        if after is not None:
+            cursor.execute(
+                f'''SELECT {columns} FROM tasks
+                WHERE child_id = ? AND is_completed = FALSE AND (created_at, id) > (?, ?)
+                ORDER BY created_at ASC, id ASC LIMIT ?''',
+                (child_id, *after, limit + 1)
+            )
+            tasks = cursor.fetchall()
+            has_more = len(tasks) > limit
+            tasks = tasks[:limit][::-1]
+            has_prev, has_next = has_more, True
+        else:
+            if before is not None:
                 cursor.execute(
-                    '''SELECT * FROM tasks 
-                    WHERE child_name = ? AND is_completed = TRUE AND completed_at > ?
-                    ORDER BY completed_at DESC''',
-                    (child_name, last_reset)
+                    f'''SELECT {columns} FROM tasks
+                    WHERE child_id = ? AND is_completed = FALSE AND (created_at, id) < (?, ?)
+                    ORDER BY created_at DESC, id DESC LIMIT ?''',
+                    (child_id, *before, limit + 1)
                 )
             else:
-                # Если обнулений не было, берем все выполненные задания
                 cursor.execute(
-                    'SELECT * FROM tasks WHERE child_name = ? AND is_completed = TRUE ORDER BY completed_at DESC',
-                    (child_name,)
+                    f'''SELECT {columns} FROM tasks
+                    WHERE child_id = ? AND is_completed = FALSE
+                    ORDER BY created_at DESC, id DESC LIMIT ?''',
+                    (child_id, limit + 1)
                 )
-        else:
-            # Для всех детей - сложная логика
-            tasks = []
-            children = self.get_all_children()
-            for child in children:
-                child_tasks = self.get_active_completed_tasks(child)
-                tasks.extend(child_tasks)
-            conn.close()
-            return tasks
+            tasks = cursor.fetchall()
+            has_next = len(tasks) > limit
+            tasks = tasks[:limit]
+            has_prev = before is not None
         
-        tasks = cursor.fetchall()
-        conn.close()
+        if not tasks:
+            return [], None, None
+        
+        prev_cursor = (tasks[0][4], tasks[0][0]) if has_prev else None
+        next_cursor = (tasks[-1][4], tasks[-1][0]) if has_next else None
+        return tasks, prev_cursor, next_cursor
+    
+    def get_active_completed_tasks(self, family_id, child_id=None):
+        """Получить выполненные задания, за которые еще не рассчитались"""
+        if child_id:
+            # Для конкретного ребенка
+            return self.get_active_completed_tasks_for_child(child_id)
+        
+        # Для всех детей семьи
+        tasks = []
+        for child_name in self.get_all_children(family_id):
+            tasks.extend(self.get_active_completed_tasks_for_child(self.get_child_id(family_id, child_name)))
         return tasks
     
-    def get_statistics(self):
-        """Получить статистику по активным заданиям (исключая обнуленные)"""
+    @cached_read(scope="family")
+    def get_statistics(self, family_id):
+        """Получить статистику семьи по активным заданиям (исключая обнуленные)"""
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -219,114 +1134,286 @@ class Database:
             "children": {}
         }
         
-        children = self.get_all_children()
+        for child in self.get_all_children(family_id):
+            stats["children"][child] = {
+                "completed": 0,
+                "pending": 0,
+                "stars": 0,
+                "recent_tasks": []
+            }
         
-        for child in children:
-            # Активные выполненные задания (после последнего обнуления)
-            active_completed = self.get_active_completed_tasks(child)
-            
-            # Все ожидающие задания
-            cursor.execute(
-                'SELECT COUNT(*) FROM tasks WHERE child_name = ? AND is_completed = FALSE',
-                (child,)
+        # Один запрос по всем детям семьи: звезды и число ожидающих награды
+        # заданий берутся из материализованных счетчиков, 5 последних - из
+        # журнала после курсора обнуления, открытые задания - по индексу
+        cursor.execute('''
+            SELECT c.name, c.stars,
+                   (SELECT COUNT(*) FROM tasks t
+                    WHERE t.child_id = c.id AND t.is_completed = FALSE),
+                   c.pending_count,
+                   r.id, r.child_name, r.task_text, r.stars_reward, r.is_completed, r.is_weekly, r.completed_at, r.created_at
+            FROM members c
+            LEFT JOIN tasks r ON r.id IN (
+                SELECT x.task_id FROM star_transactions x
+                WHERE x.child_id = c.id AND x.id > c.last_reset_tx AND x.kind = 'earn'
+                ORDER BY x.id DESC
+                LIMIT 5
             )
-            pending = cursor.fetchone()[0]
-            
-            stars = self.get_child_stars(child)
+            WHERE c.family_id = ? AND c.role = 'child'
+            ORDER BY c.name, r.completed_at DESC, r.id DESC
+        ''', (family_id,))
+        
+        counted = set()
+        for row in cursor.fetchall():
+            child, stars, pending, completed = row[:4]
+            child_stats = stats["children"].get(child)
+            if child_stats is None:
+                continue
             
-            stats["children"][child] = {
-                "completed": len(active_completed),
-                "pending": pending,
-                "stars": stars,
-                "recent_tasks": active_completed[:5]  # Последние 5 заданий
-            }
+            # Счетчики повторяются в каждой строке ребенка, учитываем один раз
+            if child not in counted:
+                counted.add(child)
+                child_stats.update(completed=completed, pending=pending, stars=stars)
+                stats["total_completed"] += completed
+                stats["total_pending"] += pending
             
-            stats["total_completed"] += len(active_completed)
-            stats["total_pending"] += pending
+            task = row[4:]
+            if task[0] is not None:
+                child_stats["recent_tasks"].append(task)
         
-        conn.close()
         return stats
     
-    def complete_task(self, task_id, child_name):
+    def complete_task(self, task_id, child_id):
         conn = self._get_connection()
         cursor = conn.cursor()
         
         try:
-            # Получаем информацию о задании
-            cursor.execute('SELECT stars_reward FROM tasks WHERE id = ?', (task_id,))
-            result = cursor.fetchone()
-            if not result:
-                return 0
-            
-            stars_reward = result[0]
+            # Вся операция - одна транзакция с блокировкой записи с самого начала,
+            # поэтому параллельные выполнения не теряют звезды
+            cursor.execute('BEGIN IMMEDIATE')
             
-            # Помечаем задание выполненным
+            # Помечаем задание выполненным, только если оно еще не выполнено
+            # и принадлежит этому ребенку: повторное нажатие ничего не начислит
             cursor.execute(
-                'UPDATE tasks SET is_completed = TRUE, completed_at = CURRENT_TIMESTAMP WHERE id = ?',
-                (task_id,)
+                '''UPDATE tasks SET is_completed = TRUE, completed_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND child_id = ? AND is_completed = FALSE''',
+                (task_id, child_id)
             )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return 0
             
-            # Начисляем звезды
-            current_stars = self.get_child_stars(child_name)
-            new_stars = current_stars + stars_reward
+            cursor.execute('SELECT stars_reward, child_name, task_text FROM tasks WHERE id = ?', (task_id,))
+            stars_reward, child_name, task_text = cursor.fetchone()
             
-            # Обновляем звезды ребенка
-            cursor.execute('UPDATE children SET stars = ? WHERE name = ?', (new_stars, child_name))
+            # Начисляем звезды атомарно, без чтения текущего баланса
+            cursor.execute(
+                '''UPDATE members
+                SET stars = stars + ?, pending_count = pending_count + 1, pending_stars = pending_stars + ?,
+                    completed_total = completed_total + 1
+                WHERE id = ?''',
+                (stars_reward, stars_reward, child_id)
+            )
+            cursor.execute(
+                'INSERT INTO star_transactions (child_id, child_name, kind, amount, task_id) VALUES (?, ?, ?, ?, ?)',
+                (child_id, child_name, "earn", stars_reward, task_id)
+            )
             
             conn.commit()
+            self._bump_version(self._family_of(child_id))
+            self._publish("task_completed", child_id, child_name=child_name, task_text=task_text, stars=stars_reward)
             return stars_reward
             
-        except Exception as e:
-            print(f"Ошибка: {e}")
+        except Exception:
+            # Повторное нажатие уже отсечено выше (вернули 0); все прочее, в том
+            # числе database is locked, - сбой, о котором должен узнать вызывающий
+            logger.exception(f"❌ Задание {task_id} не выполнено")
             conn.rollback()
-            return 0
-        finally:
-            conn.close()
+            raise
+    
+    def delete_weekly_tasks(self, keep_week=None):
+        """Убрать невыполненные еженедельные задания в архив (кроме засеянных на keep_week)"""
+        conn = self._get_connection()
+        # Выполненные задания остаются: на них ссылается журнал звезд
+        if keep_week:
+            _move_to_archive(
+                conn, "tasks",
+                'is_weekly = TRUE AND is_completed = FALSE AND (seed_key IS NULL OR seed_key NOT LIKE ?)',
+                (f"{keep_week}:%",)
+            )
+        else:
+            _move_to_archive(conn, "tasks", 'is_weekly = TRUE AND is_completed = FALSE')
+        conn.commit()
+        self._bump_version()
     
-    def delete_weekly_tasks(self):
-        """Удалить все еженедельные задания"""
+    def archive_history(self, keep_days=28, batch_size=500):
+        """Перенести в архив историю, которую не читают рабочие запросы.
+        
+        Уходят выполненные задания, за которые уже рассчитались (выполнены
+        до последнего обнуления ребенка), и все обнуления, кроме последнего,
+        если они старше keep_days дней. Счетчики и журнал звезд не меняются,
+        история доступна через представления tasks_history и star_resets_history.
+        Возвращает (заданий, обнулений) перенесено.
+        """
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM tasks WHERE is_weekly = TRUE')
+        cursor.execute("SELECT datetime('now', ?)", (f"-{int(keep_days)} days",))
+        cutoff = cursor.fetchone()[0]
+        
+        cursor.execute('SELECT child_id, MAX(reset_at) FROM star_resets GROUP BY child_id')
+        last_resets = cursor.fetchall()
+        
+        tasks_moved = 0
+        for child_id, last_reset in last_resets:
+            # Строго раньше обнуления: задание, выполненное в ту же секунду,
+            # могло попасть уже после него и еще ждать награды
+            tasks_moved += _move_to_archive(
+                conn, "tasks",
+                'child_id = ? AND is_completed = TRUE AND completed_at < ? AND completed_at < ?',
+                (child_id, last_reset, cutoff),
+                batch_size
+            )
+        
+        resets_moved = _move_to_archive(
+            conn, "star_resets",
+            '''reset_at < ? AND reset_at < (
+                SELECT MAX(r.reset_at) FROM star_resets r WHERE r.child_id = star_resets.child_id
+            )''',
+            (cutoff,),
+            batch_size
+        )
+        
+        if tasks_moved or resets_moved:
+            self._bump_version()
+        return tasks_moved, resets_moved
+    
+    def compact(self, pages=1000):
+        """Вернуть освобожденные архивом страницы и обновить статистику планировщика"""
+        conn = self._get_connection()
         conn.commit()
-        conn.close()
+        cursor = conn.cursor()
+        
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            # Инкрементальный режим включается только полным VACUUM - один раз
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        else:
+            cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+            cursor.fetchall()
+        cursor.execute('PRAGMA optimize')
+    
+    def get_job_last_run(self, name):
+        """Время (unix) последнего успешного запуска задачи планировщика"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT last_run FROM scheduled_jobs WHERE name = ?', (name,))
+        result = cursor.fetchone()
+        return result[0] if result else None
     
-    def has_weekly_tasks(self):
-        """Проверить есть ли недельные задания"""
+    def set_job_last_run(self, name, last_run):
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM tasks WHERE is_weekly = TRUE')
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count > 0
+        cursor.execute(
+            'INSERT OR REPLACE INTO scheduled_jobs (name, last_run) VALUES (?, ?)',
+            (name, last_run)
+        )
+        conn.commit()
     
-    def get_active_completed_tasks_for_child(self, child_name):
+    @cached_read()
+    def get_active_completed_tasks_for_child(self, child_id):
         """Получить выполненные задания ребенка, за которые еще не рассчитались"""
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        # Получаем время последнего обнуления
-        last_reset = self.get_last_reset_time(child_name)
-        
-        if last_reset:
-            # Берем задания выполненные ПОСЛЕ последнего обнуления
-            cursor.execute(
-                '''SELECT * FROM tasks 
-                WHERE child_name = ? AND is_completed = TRUE AND completed_at > ?
-                ORDER BY completed_at DESC''',
-                (child_name, last_reset)
-            )
-        else:
-            # Если обнулений не было, берем все выполненные задания
-            cursor.execute(
-                'SELECT * FROM tasks WHERE child_name = ? AND is_completed = TRUE ORDER BY completed_at DESC',
-                (child_name,)
-            )
+        # Начисления журнала после курсора последнего обнуления: диапазон по
+        # индексу, не зависящий от длины истории
+        cursor.execute(
+            '''SELECT t.id, t.child_name, t.task_text, t.stars_reward, t.is_completed, t.is_weekly, t.completed_at, t.created_at FROM members c
+            JOIN star_transactions x ON x.child_id = c.id AND x.id > c.last_reset_tx
+            JOIN tasks t ON t.id = x.task_id
+            WHERE c.id = ? AND x.kind = 'earn'
+            ORDER BY x.id DESC''',
+            (child_id,)
+        )
         
         tasks = cursor.fetchall()
-        conn.close()
         return tasks
 
-    def get_pending_reward_tasks(self, child_name):
+    def get_pending_reward_tasks(self, child_id):
         """Получить задания, за которые ожидается награда (выполнены но не обнулены)"""
-        return self.get_active_completed_tasks_for_child(child_name)
\ No newline at end of file
+        return self.get_active_completed_tasks_for_child(child_id)
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database для обработчиков aiogram.
+
+    Все запросы выполняются в выделенном потоке, поэтому SQLite (включая fsync
+    при commit) не блокирует event loop. Методы те же, что у Database,
+    но возвращают awaitable: ``await db.get_tasks(child)``.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        # Один поток на файл базы: записи в него последовательны и без конкуренции,
+        # а шарды (utils.shards.ShardedDatabase) пишут параллельно
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db{i}")
+            for i in range(getattr(db, "shard_count", 1))
+        ]
+        self._sharded = len(self._executors) > 1
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            shard = 0
+            if self._sharded:
+                shard = await self._resolve_shard(self.db.peek_shard_of_call, self.db.shard_of_call, name, args)
+            return await self._run_in(self._executors[shard], attr, *args, **kwargs)
+
+        setattr(self, name, method)
+        return method
+
+    async def _resolve_shard(self, peek, resolve, *args):
+        """Шард из кэша размещения, а при промахе - запросом в потоке основной
+        базы: в event loop SQLite не вызывается"""
+        shard = peek(*args)
+        if shard is None:
+            shard = await self._run_in(self._executors[0], resolve, *args)
+        return shard
+
+    async def _run_in(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить произвольную функцию в потоке основной базы данных"""
+        return await self._run_in(self._executors[0], func, *args, **kwargs)
+
+    async def run_for_family(self, family_id, func, *args, **kwargs):
+        """Выполнить функцию в потоке шарда семьи: читать данные семьи нужно
+        там, иначе соединение чужого потока примет свои же записи за внешние
+        и сбросит кэш чтения всего шарда"""
+        shard = 0
+        if self._sharded:
+            shard = await self._resolve_shard(self.db.peek_shard_of_family, self.db.shard_of_family, family_id)
+        return await self._run_in(self._executors[shard], func, *args, **kwargs)
+
+    async def run_on_shards(self, func, *args, **kwargs):
+        """Выполнить func(база шарда, ...) для каждого шарда в его потоке
+        (без шардов - один раз для Database). Возвращает список результатов."""
+        shards = self.db.shards if self._sharded else [self.db]
+        return await asyncio.gather(*(
+            self._run_in(executor, func, shard, *args, **kwargs)
+            for executor, shard in zip(self._executors, shards)
+        ))
+
+    async def close(self):
+        """Дождаться очереди запросов и закрыть соединения"""
+        for executor in self._executors[1:]:
+            executor.shutdown(wait=True)
+        await self.run(self.db.close)
+        self._executors[0].shutdown(wait=True)
@@ -26,7 +26,8 @@ DEFAULT_TASKS = {
     ],
 }
 
-# Еженедельные задания (обновляются каждую неделю)
+# Еженедельные задания (обновляются каждую неделю). Миграция базы переносит их
+# в шаблоны детей первой семьи, дальше шаблоны живут в таблице weekly_templates
 WEEKLY_TASKS = {
     "djama": [
         {"text": "Прочитать новую книгу", "stars": 10},
@@ -1,117 +1,142 @@
+import html
+
 from aiogram import Router, types
-from database import Database
-from keyboards import get_main_child_keyboard, get_tasks_keyboard, get_children_keyboard
+from database import AsyncDatabase
+from keyboards import (
+    get_main_child_keyboard, get_tasks_keyboard, get_children_keyboard,
+    BTN_MY_TASKS, BTN_MY_STARS, BTN_SWITCH_CHILD, BTN_LOGOUT, PAGE_CALLBACK_PREFIX,
+)
+from utils.buttons import ButtonRouter, callback_prefix
+from utils.session import is_child
 
 # Создаем роутер
 router = Router()
-
-db = Database()
+buttons = ButtonRouter(router)
+# Детских обработчиков состояний нет, поэтому индекс кнопок проверяется первым
+buttons.register()
 
 # ЗАДАНИЯ
-@router.message(lambda message: message.text == "📋 Мои задания")
-async def cmd_my_tasks(message: types.Message):
-    current_child = db.get_current_user(message.from_user.id)
-    if not current_child:
+@buttons.button(BTN_MY_TASKS)
+async def cmd_my_tasks(message: types.Message, member: dict, db: AsyncDatabase):
+    if not is_child(member):
         await message.answer("❌ Сначала войдите как сыночка через /start")
         return
     
-    tasks = db.get_tasks(current_child, completed=False)
+    tasks, prev_cursor, next_cursor = await db.get_tasks_page(member["id"])
     
     if not tasks:
         await message.answer("📝 Нет 🎯!")
         return
     
-    text = f"📋 <b>Задания для {current_child.capitalize()}</b>\n\n"
-    # for task in tasks:
-    #     task_id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at = task
-    #     emoji = "🔄 " if is_weekly else ""
-    #     text += f"{emoji}{task_text} <b>(+{stars_reward}⭐)</b>\n"
+    text = f"📋 <b>Задания для {html.escape(member['name'].capitalize())}</b>\n\n"
     
-    await message.answer(text, reply_markup=get_tasks_keyboard(tasks), parse_mode="HTML")
+    await message.answer(
+        text,
+        reply_markup=get_tasks_keyboard(tasks, prev_cursor, next_cursor),
+        parse_mode="HTML"
+    )
 
-# ЗВЕЗДЫ
-@router.message(lambda message: message.text == "⭐ Мои звезды")
-async def cmd_my_stars(message: types.Message):
-    current_child = db.get_current_user(message.from_user.id)
-    if not current_child or current_child == "parent":
-        await message.answer("❌ Сначала войдите как сыночка через /start")
+# ЛИСТАНИЕ ЗАДАНИЙ
+@router.callback_query(callback_prefix(PAGE_CALLBACK_PREFIX))
+async def process_tasks_page(callback: types.CallbackQuery, member: dict, db: AsyncDatabase):
+    if not is_child(member):
+        await callback.answer("❌ Сначала войдите как сыночка")
         return
     
-    stars = db.get_child_stars(current_child)
+    # page:<направление><created_at>|<id>, см. keyboards.page_callback_data
+    payload = callback.data[len(PAGE_CALLBACK_PREFIX):]
+    direction, cursor = payload[0], payload[1:]
+    created_at, task_id = cursor.rsplit("|", 1)
+    page_cursor = (created_at, int(task_id))
     
-    # Получаем разные типы заданий
-    pending_reward_tasks = db.get_pending_reward_tasks(current_child)
+    if direction == "<":
+        page = await db.get_tasks_page(member["id"], after=page_cursor)
+    else:
+        page = await db.get_tasks_page(member["id"], before=page_cursor)
+    tasks, prev_cursor, next_cursor = page
     
-    # Получаем общую статистику
-    import sqlite3
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
+    if not tasks:
+        # Задания со страницы успели выполнить - возвращаемся к началу
+        tasks, prev_cursor, next_cursor = await db.get_tasks_page(member["id"])
     
-    # Всего выполненных заданий за все время
-    cursor.execute("SELECT COUNT(*) FROM tasks WHERE child_name = ? AND is_completed = TRUE", (current_child,))
-    total_completed = cursor.fetchone()[0]
+    if tasks:
+        await callback.message.edit_text(
+            f"📋 <b>Задания для {html.escape(member['name'].capitalize())}</b>\n\n",
+            reply_markup=get_tasks_keyboard(tasks, prev_cursor, next_cursor),
+            parse_mode="HTML"
+        )
+    else:
+        await callback.message.edit_text("📝 Нет 🎯!")
     
-    # Ожидающие выполнения задания
-    cursor.execute("SELECT COUNT(*) FROM tasks WHERE child_name = ? AND is_completed = FALSE", (current_child,))
-    pending_tasks = cursor.fetchone()[0]
+    await callback.answer()
+
+# ЗВЕЗДЫ
+@buttons.button(BTN_MY_STARS)
+async def cmd_my_stars(message: types.Message, member: dict, db: AsyncDatabase):
+    if not is_child(member):
+        await message.answer("❌ Сначала войдите как сыночка через /start")
+        return
     
-    conn.close()
+    summary = await db.get_child_summary(member["id"])
+    stars = summary["stars"]
+    pending_reward_count = summary["pending_count"]
     
-    text = f"⭐ <b>Статистика {current_child.capitalize()}</b>\n\n"
+    text = f"⭐ <b>Статистика {html.escape(member['name'].capitalize())}</b>\n\n"
     
     # Текущий баланс
     text += f"💰 <b>Текущие звезды:</b> {stars}⭐\n\n"
     
     # Задания ожидающие награды
-    if pending_reward_tasks:
-        text += f"✅ <b>Ожидают награды:</b> {len(pending_reward_tasks)} 🎯\n"
-        
-        total_pending_stars = sum(task[3] for task in pending_reward_tasks)
-        text += f"💫 <b>Будут начислены:</b> {total_pending_stars}⭐\n\n"
+    if pending_reward_count:
+        text += f"✅ <b>Ожидают награды:</b> {pending_reward_count} 🎯\n"
+        text += f"💫 <b>Будут начислены:</b> {summary['pending_stars']}⭐\n\n"
         
         text += "<b>Последние задания:</b>\n"
-        for i, task in enumerate(pending_reward_tasks[:5], 1):
+        for i, task in enumerate(summary["recent_tasks"], 1):
             task_id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at = task
             emoji = "🔄 " if is_weekly else ""
-            text += f"   {i}. {emoji}{task_text} <b>(+{stars_reward}⭐)</b>\n"
+            text += f"   {i}. {emoji}{html.escape(task_text)} <b>(+{stars_reward}⭐)</b>\n"
         
-        if len(pending_reward_tasks) > 5:
-            text += f"   ... и еще {len(pending_reward_tasks) - 5}\n"
+        if pending_reward_count > 5:
+            text += f"   ... и еще {pending_reward_count - 5}\n"
         
         text += "\n"
     
     # Общая статистика
     text += "📊 <b>Общая статистика:</b>\n"
-    text += f"   ✅ Выполнено за все время: {total_completed} 🎯\n"
-    text += f"   📝 Ожидает выполнения: {pending_tasks} 🎯\n"
+    text += f"   ✅ Выполнено за все время: {summary['total_completed']} 🎯\n"
+    text += f"   📝 Ожидает выполнения: {summary['open']} 🎯\n"
     
-    if pending_reward_tasks:
-        text += f"   🎁 Ожидают 🏆: {len(pending_reward_tasks)} 🎯\n"
+    if pending_reward_count:
+        text += f"   🎁 Ожидают 🏆: {pending_reward_count} 🎯\n"
     
     # Мотивационные сообщения
     text += "\n"
-    if stars == 0 and not pending_reward_tasks:
+    if stars == 0 and not pending_reward_count:
         text += "Выполняй 🎯 Зарабатывай ⭐ Получай 🏆"
     elif stars > 0:
         text += f"💫 У тебя {stars} ⭐ - Жди 🏆!"
-    elif pending_reward_tasks:
-        text += f"📋 Выполнено {len(pending_reward_tasks)} 🎯 - жди 🏆 в конце недели"
+    elif pending_reward_count:
+        text += f"📋 Выполнено {pending_reward_count} 🎯 - жди 🏆 в конце недели"
     
     await message.answer(text, parse_mode="HTML")
 
 # ВЫПОЛНЕНИЕ ЗАДАНИЙ
-@router.callback_query(lambda c: c.data.startswith('complete:'))
-async def process_task_completion(callback: types.CallbackQuery):
-    current_child = db.get_current_user(callback.from_user.id)
-    if not current_child:
+@router.callback_query(callback_prefix('complete:'))
+async def process_task_completion(callback: types.CallbackQuery, member: dict, db: AsyncDatabase):
+    if not is_child(member):
         await callback.answer("❌ Сначала войдите как сыночка")
         return
     
     task_id = int(callback.data.split(":")[1])
-    earned_stars = db.complete_task(task_id, current_child)
+    try:
+        earned_stars = await db.complete_task(task_id, member["id"])
+    except Exception:
+        # Ошибка уже записана в лог базой: отвечаем, чтобы кнопка не крутилась
+        earned_stars = 0
     
     if earned_stars > 0:
-        current_stars = db.get_child_stars(current_child)
+        current_stars = await db.get_child_stars(member["id"])
         await callback.message.edit_text(
             f"🎉 Задание выполнено!\n"
             f"💫 Получено: {earned_stars}⭐\n"
@@ -123,20 +148,32 @@ async def process_task_completion(callback: types.CallbackQuery):
     await callback.answer()
 
 # СМЕНА РЕБЕНКА
-@router.message(lambda message: message.text == "🔄 Сменить ребенка")
-async def cmd_switch_child(message: types.Message):
-    children = db.get_all_children()
+@buttons.button(BTN_SWITCH_CHILD)
+async def cmd_switch_child(message: types.Message, member: dict, db: AsyncDatabase):
+    if not member:
+        await message.answer("❌ Сначала войдите через /start")
+        return
+    
+    children = await db.get_all_children(member["family_id"])
     if len(children) <= 1:
         await message.answer("❌ Нет других детей для переключения")
         return
     
     await message.answer("👥 Выберите ребенка:", reply_markup=get_children_keyboard(children))
 
-@router.message(lambda message: message.text in [child.capitalize() for child in db.get_all_children()])
-async def process_switch_child(message: types.Message):
+async def is_child_name(message: types.Message, member: dict, db: AsyncDatabase):
+    """Фильтр: текст - имя ребенка из семьи пользователя; передает child_id"""
+    if not member or not message.text:
+        return False
+    # Поиск по индексу (семья, имя), результат кэшируется до изменений в семье
+    child_id = await db.get_child_id(member["family_id"], message.text.lower())
+    return {"child_id": child_id} if child_id else False
+
+@router.message(is_child_name)
+async def process_switch_child(message: types.Message, child_id: int, db: AsyncDatabase):
     child_name = message.text.lower()
-    db.set_current_child(message.from_user.id, child_name)
-    stars = db.get_child_stars(child_name)
+    await db.set_current_user(message.from_user.id, child_id)
+    stars = await db.get_child_stars(child_id)
     
     await message.answer(
         f"✅ Теперь вы {child_name.capitalize()}!\n⭐ Звезды: {stars}",
@@ -144,7 +181,7 @@ async def process_switch_child(message: types.Message):
     )
 
 # ВЫХОД
-@router.message(lambda message: message.text == "🚪 Выход")
-async def cmd_logout(message: types.Message):
-    db.set_current_child(message.from_user.id, None)
+@buttons.button(BTN_LOGOUT)
+async def cmd_logout(message: types.Message, db: AsyncDatabase):
+    await db.set_current_user(message.from_user.id, None)
     await message.answer("👋 Вы вышли!", reply_markup=types.ReplyKeyboardRemove())
\ No newline at end of file
@@ -1,69 +1,83 @@
+import asyncio
+
 from aiogram import Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
-import config
+from database import AsyncDatabase, verify_password
 from keyboards import get_main_child_keyboard, get_main_parent_keyboard
 
 # Создаем роутер
 router = Router()
 
-db = Database()
+LOGIN_PROMPT = "Введите номер семьи и имя через пробел (например: 2 маша):"
 
 class LoginState(StatesGroup):
+    waiting_for_login = State()
     waiting_for_password = State()
 
 @router.message(Command("start"))
-async def cmd_start(message: types.Message, state: FSMContext):
+async def cmd_start(message: types.Message, state: FSMContext, member: dict, db: AsyncDatabase):
     # Проверяем текущую сессию
-    current_user = db.get_current_user(message.from_user.id)
-    
-    if current_user:
-        if current_user == "parent":
+    if member:
+        if member["role"] == "parent":
             await send_parent_menu(message)
         else:
-            await show_child_interface(message, current_user)
+            await show_child_interface(message, member, db)
+        return
+    
+    await message.answer(f"👋 Добро пожаловать! {LOGIN_PROMPT}")
+    await state.set_state(LoginState.waiting_for_login)
+
+@router.message(StateFilter(LoginState.waiting_for_login))
+async def process_login(message: types.Message, state: FSMContext):
+    family_id, _, name = (message.text or "").strip().partition(" ")
+    if not family_id.isdigit() or not name.strip():
+        await message.answer(f"❌ {LOGIN_PROMPT}")
         return
     
-    await message.answer("👋 Добро пожаловать! Введите пароль:")
+    await state.update_data(family_id=int(family_id), name=name.strip())
+    await message.answer("🔑 Введите пароль:")
     await state.set_state(LoginState.waiting_for_password)
 
-@router.message(LoginState.waiting_for_password)
-async def process_password(message: types.Message, state: FSMContext):
-    password = message.text.strip()
+@router.message(StateFilter(LoginState.waiting_for_password))
+async def process_password(message: types.Message, state: FSMContext, db: AsyncDatabase):
+    password = (message.text or "").strip()
+    data = await state.get_data()
     
-    # Определяем кто входит по паролю
-    user_type = None
-    for user, pwd in config.PASSWORDS.items():
-        if password == pwd:
-            user_type = user
-            break
+    # Участник ищется в своей семье по имени; scrypt - в отдельном потоке,
+    # чтобы не занимать ни event loop, ни поток базы
+    login = await db.get_login(data["family_id"], data["name"])
+    member = None
+    if login and await asyncio.to_thread(verify_password, password, login[1]):
+        member = login[0]
     
-    if user_type == "parent":
-        db.set_current_user(message.from_user.id, "parent")
+    if member and member["role"] == "parent":
+        await db.set_current_user(message.from_user.id, member["id"])
         await message.answer("✅ Вы вошли как родитель!", reply_markup=get_main_parent_keyboard())
         await state.clear()
     
-    elif user_type in ["djama", "ramz", "riza"]:
-        db.set_current_user(message.from_user.id, user_type)
-        stars = db.get_child_stars(user_type)
+    elif member:
+        await db.set_current_user(message.from_user.id, member["id"])
+        stars = await db.get_child_stars(member["id"])
         await message.answer(
-            f"✅ Привет, {user_type.capitalize()}!\n⭐ Твои звезды: {stars}",
+            f"✅ Привет, {member['name'].capitalize()}!\n⭐ Твои звезды: {stars}",
             reply_markup=get_main_child_keyboard()
         )
         await state.clear()
     
     else:
-        await message.answer("❌ Неверный пароль. Попробуйте еще раз:")
+        # Не говорим, что именно не так: имя или пароль
+        await message.answer(f"❌ Неверное имя или пароль. {LOGIN_PROMPT}")
+        await state.set_state(LoginState.waiting_for_login)
 
 async def send_parent_menu(message: types.Message):
     await message.answer("👨‍👩‍👧‍👦 Панель родителя:", reply_markup=get_main_parent_keyboard())
 
-async def show_child_interface(message: types.Message, child_name: str):
-    stars = db.get_child_stars(child_name)
+async def show_child_interface(message: types.Message, member: dict, db: AsyncDatabase):
+    stars = await db.get_child_stars(member["id"])
     await message.answer(
-        f"👤 {child_name.capitalize()}\n⭐ Звезды: {stars}",
+        f"👤 {member['name'].capitalize()}\n⭐ Звезды: {stars}",
         reply_markup=get_main_child_keyboard()
     )
\ No newline at end of file
@@ -1,15 +1,25 @@
+import html
+
 from aiogram import Router, types
+from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
-from keyboards import get_main_parent_keyboard, get_children_keyboard, get_reset_stars_keyboard
-from default_tasks import WEEKLY_TASKS
-
-# Создаем роутер
+from database import AsyncDatabase
+from keyboards import (
+    get_main_parent_keyboard, get_children_keyboard, get_reset_stars_keyboard,
+    BTN_ADD_TASK, BTN_ADD_WEEKLY_TASKS, BTN_STATISTICS, BTN_REWARD, BTN_LOGOUT, BTN_BACK,
+    BTN_REWARD_CHILD_PREFIX,
+)
+from utils.buttons import ButtonRouter
+from utils.report import StatisticsReport
+from utils.session import parent_only
+
+# Создаем роутер: все его обработчики - только для вошедшего родителя
 router = Router()
-
-db = Database()
+router.message.filter(parent_only)
+buttons = ButtonRouter(router)
+statistics_report = StatisticsReport()
 
 class ParentState(StatesGroup):
     waiting_for_child_selection = State()
@@ -17,40 +27,41 @@ class ParentState(StatesGroup):
     waiting_for_stars = State()
 
 # ДОБАВЛЕНИЕ ЗАДАНИЙ
-@router.message(lambda message: message.text == "📝 Добавить задание")
-async def cmd_add_task(message: types.Message, state: FSMContext):
-    children = db.get_all_children()
+@buttons.button(BTN_ADD_TASK)
+async def cmd_add_task(message: types.Message, state: FSMContext, member: dict, db: AsyncDatabase):
+    children = await db.get_all_children(member["family_id"])
     await message.answer("👶 Для кого задание?", reply_markup=get_children_keyboard(children))
     await state.set_state(ParentState.waiting_for_child_selection)
 
-@router.message(ParentState.waiting_for_child_selection)
-async def process_child_selection(message: types.Message, state: FSMContext):
-    if message.text == "🔙 Назад":
+@router.message(StateFilter(ParentState.waiting_for_child_selection))
+async def process_child_selection(message: types.Message, state: FSMContext, member: dict, db: AsyncDatabase):
+    if message.text == BTN_BACK:
         await send_parent_menu(message)
         await state.clear()
         return
     
     child_name = message.text.lower()
-    if child_name not in db.get_all_children():
+    child_id = await db.get_child_id(member["family_id"], child_name)
+    if child_id is None:
         await message.answer("❌ Выберите ребенка из списка")
         return
     
-    await state.update_data(child_name=child_name)
+    await state.update_data(child_id=child_id, child_name=child_name)
     await message.answer("📝 Введите задание:", reply_markup=types.ReplyKeyboardRemove())
     await state.set_state(ParentState.waiting_for_task)
 
-@router.message(ParentState.waiting_for_task)
+@router.message(StateFilter(ParentState.waiting_for_task))
 async def process_task_text(message: types.Message, state: FSMContext):
     await state.update_data(task_text=message.text)
     await message.answer("⭐ Сколько звезд?")
     await state.set_state(ParentState.waiting_for_stars)
 
-@router.message(ParentState.waiting_for_stars)
-async def process_task_stars(message: types.Message, state: FSMContext):
+@router.message(StateFilter(ParentState.waiting_for_stars))
+async def process_task_stars(message: types.Message, state: FSMContext, db: AsyncDatabase):
     try:
         stars = int(message.text)
         data = await state.get_data()
-        db.add_task(data['child_name'], data['task_text'], stars)
+        await db.add_task(data['child_id'], data['task_text'], stars)
         
         await message.answer(
             f"✅ Задание для {data['child_name'].capitalize()} добавлено!",
@@ -61,12 +72,23 @@ async def process_task_stars(message: types.Message, state: FSMContext):
         await message.answer("❌ Введите число:")
 
 # НЕДЕЛЬНЫЕ ЗАДАНИЯ
-@router.message(lambda message: message.text == "🔄 Добавить недельные задания")
-async def cmd_add_weekly_tasks(message: types.Message):
-    # Добавляем недельные задания для всех детей
-    db.add_tasks_for_all_children(WEEKLY_TASKS)
+@buttons.button(BTN_ADD_WEEKLY_TASKS)
+async def cmd_add_weekly_tasks(message: types.Message, member: dict, db: AsyncDatabase):
+    # Добавляем недельные задания для всех детей семьи, не чаще раза в неделю
+    task_count = await db.seed_weekly_tasks(member["family_id"])
+    if task_count is None:
+        await message.answer(
+            "ℹ️ Для вашей семьи еще не заданы недельные задания",
+            reply_markup=get_main_parent_keyboard()
+        )
+        return
+    if not task_count:
+        await message.answer(
+            "ℹ️ Недельные задания на эту неделю уже добавлены",
+            reply_markup=get_main_parent_keyboard()
+        )
+        return
     
-    task_count = sum(len(tasks) for tasks in WEEKLY_TASKS.values())
     await message.answer(
         f"✅ Недельные задания добавлены!\n"
         f"📝 Всего заданий: {task_count}\n"
@@ -74,77 +96,25 @@ async def cmd_add_weekly_tasks(message: types.Message):
         reply_markup=get_main_parent_keyboard()
     )
 
-@router.message(lambda message: message.text  == "📊 Статистика")
-async def cmd_tasks_and_stats(message: types.Message):
-    from datetime import datetime
-
-    stats = db.get_statistics()
-    tasks = db.get_tasks()
-
-    text = "📋 <b>Задания и статистика</b>\n\n"
-
-    # Общая статистика
-    text += f"✅ Выполнено: <b>{stats['total_completed']}</b>\n"
-    text += f"📝 Ожидает выполнения: <b>{stats['total_pending']}</b>\n\n"
-
-    # По детям
-    for child_name, child_stats in stats["children"].items():
-        text += (
-            f"👤 <b>{child_name.capitalize()}</b>\n"
-            f"   ✅ {child_stats['completed']} | 📝 {child_stats['pending']} | ⭐ {child_stats['stars']}\n\n"
-        )
-
-    # Последние выполненные задания
-    recent_tasks_all = []
-    for child_name, child_stats in stats["children"].items():
-        recent_tasks_all.extend(child_stats["recent_tasks"])
-
-    recent_tasks_all.sort(key=lambda x: x[6] or "", reverse=True)
-    recent_tasks = recent_tasks_all[:5]
-
-    if recent_tasks:
-        text += "🕒 <b>Последние выполненные:</b>\n"
-        for task in recent_tasks:
-            task_id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at = task
-            if completed_at:
-                try:
-                    dt = datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
-                    time_str = dt.strftime("%d.%m %H:%M")
-                except:
-                    time_str = "недавно"
-                text += f"   {child_name.capitalize()}: {task_text} ({stars_reward}⭐, {time_str})\n"
-        text += "\n"
-
-    # Список текущих активных заданий
-    if tasks:
-        tasks_dict = {}
-        for task in tasks:
-            if task[1] not in tasks_dict:
-                tasks_dict[task[1]] = []
-            tasks_dict[task[1]].append(task)
-
-        text += "📝 <b>Активные задания:</b>\n\n"
-        for child_name, child_tasks in tasks_dict.items():
-            text += f"👶 {child_name.capitalize()}:\n"
-            for task in child_tasks:
-                text += f"   - {task[2]} ({task[3]}⭐)\n"
-            text += "\n"
-    else:
-        text += "❌ Активных заданий нет.\n"
-
-    await message.answer(text, parse_mode="HTML", reply_markup=get_main_parent_keyboard())
+@buttons.button(BTN_STATISTICS)
+async def cmd_tasks_and_stats(message: types.Message, member: dict, db: AsyncDatabase):
+    # Отчет собирается в потоке шарда семьи и кэшируется до следующего изменения ее данных
+    messages = await db.run_for_family(member["family_id"], statistics_report.render, db.db, member["family_id"])
+    
+    for i, text in enumerate(messages, 1):
+        # Клавиатура - только у последней части отчета
+        reply_markup = get_main_parent_keyboard() if i == len(messages) else None
+        await message.answer(text, parse_mode="HTML", reply_markup=reply_markup)
 
 # Награждение
-@router.message(lambda message: message.text == "💵 Наградить")
-async def cmd_reward(message: types.Message):
+@buttons.button(BTN_REWARD)
+async def cmd_reward(message: types.Message, member: dict, db: AsyncDatabase):
     # Находим детей с ненулевым балансом
-    children = db.get_all_children()
-    children_with_stars = []
-    
-    for child in children:
-        stars = db.get_child_stars(child)
-        if stars > 0:
-            children_with_stars.append((child, stars))
+    children_with_stars = [
+        (child, stars)
+        for child, stars in await db.get_children_stars(member["family_id"])
+        if stars > 0
+    ]
     
     if not children_with_stars:
         await message.answer("💰 У всех детей 0 звезд!")
@@ -152,7 +122,7 @@ async def cmd_reward(message: types.Message):
     
     text = "💵 <b>Награждение</b>\n\nВыберите ребенка:\n"
     for child, stars in children_with_stars:
-        text += f"👤 {child.capitalize()}: <b>{stars}⭐</b>\n"
+        text += f"👤 {html.escape(child.capitalize())}: <b>{stars}⭐</b>\n"
     
     await message.answer(
         text,
@@ -160,12 +130,16 @@ async def cmd_reward(message: types.Message):
         parse_mode="HTML"
     )
 
-@router.message(lambda message: message.text.startswith("💵 "))
-async def process_reset_stars(message: types.Message):
+@buttons.prefix(BTN_REWARD_CHILD_PREFIX)
+async def process_reset_stars(message: types.Message, member: dict, db: AsyncDatabase):
     # Извлекаем имя ребенка из текста кнопки
-    child_name = message.text.replace("💵 ", "").split(" (")[0].lower()
+    child_name = message.text[len(BTN_REWARD_CHILD_PREFIX):].split(" (")[0].lower()
+    child_id = await db.get_child_id(member["family_id"], child_name)
+    if child_id is None:
+        await message.answer("❌ Выберите ребенка из списка")
+        return
     
-    db.reset_child_stars(child_name)
+    await db.reset_child_stars(child_id)
     await message.answer(
         f"✅ Награжден {child_name.capitalize()}!\n"
         f"💫 Звезды ждут",
@@ -173,10 +147,13 @@ async def process_reset_stars(message: types.Message):
     )
 
 # ВЫХОД
-@router.message(lambda message: message.text == "🚪 Выход")
-async def cmd_logout(message: types.Message):
-    db.set_current_user(message.from_user.id, None)
+@buttons.button(BTN_LOGOUT)
+async def cmd_logout(message: types.Message, db: AsyncDatabase):
+    await db.set_current_user(message.from_user.id, None)
     await message.answer("👋 Вы вышли!", reply_markup=types.ReplyKeyboardRemove())
 
 async def send_parent_menu(message: types.Message):
-    await message.answer("👨‍👩‍👧‍👦 Панель родителя:", reply_markup=get_main_parent_keyboard())
\ No newline at end of file
+    await message.answer("👨‍👩‍👧‍👦 Панель родителя:", reply_markup=get_main_parent_keyboard())
+
+# Кнопки подключаются после обработчиков состояний: ввод посреди диалога достается им
+buttons.register()
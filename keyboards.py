@@ -1,65 +1,146 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from pydantic import ConfigDict, field_serializer
+
+from utils.cache import LRUCache, MISSING
+
+# ТЕКСТЫ КНОПОК (по ним же роутеры строят индекс обработчиков)
+BTN_ADD_TASK = "📝 Добавить задание"
+BTN_ADD_WEEKLY_TASKS = "🔄 Добавить недельные задания"
+BTN_STATISTICS = "📊 Статистика"
+BTN_REWARD = "💵 Наградить"
+BTN_MY_TASKS = "📋 Мои задания"
+BTN_MY_STARS = "⭐ Мои звезды"
+BTN_SWITCH_CHILD = "🔄 Сменить ребенка"
+BTN_LOGOUT = "🚪 Выход"
+BTN_BACK = "🔙 Назад"
+# Кнопки награждения: "💵 Имя (N⭐)"
+BTN_REWARD_CHILD_PREFIX = "💵 "
+# Листание списка заданий
+PAGE_CALLBACK_PREFIX = "page:"
+
+# НЕИЗМЕНЯЕМАЯ РАЗМЕТКА
+# Разметка клавиатур в aiogram изменяемая, а здесь один объект уходит во все
+# ответы (готовые меню и кэш ниже): присваивание полей запрещено, ряды
+# кнопок - кортежи. При отправке ряды снова становятся списками: кортежи
+# сессия aiogram не сериализует
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    keyboard: tuple[tuple[KeyboardButton, ...], ...]
+
+    @field_serializer("keyboard")
+    def _serialize_rows(self, rows):
+        return [list(row) for row in rows]
+
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    inline_keyboard: tuple[tuple[InlineKeyboardButton, ...], ...]
+
+    @field_serializer("inline_keyboard")
+    def _serialize_rows(self, rows):
+        return [list(row) for row in rows]
 
 # ОСНОВНЫЕ КЛАВИАТУРЫ
+# Собираются один раз при импорте: разметка неизменяемая, одну и ту же
+# можно отправлять в любое количество ответов
+MAIN_PARENT_KEYBOARD = FrozenReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BTN_ADD_TASK)],
+        [KeyboardButton(text=BTN_ADD_WEEKLY_TASKS)],
+        [KeyboardButton(text=BTN_STATISTICS)],
+        [KeyboardButton(text=BTN_REWARD)],
+        [KeyboardButton(text=BTN_LOGOUT)]
+    ],
+    resize_keyboard=True
+)
+
+MAIN_CHILD_KEYBOARD = FrozenReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BTN_MY_TASKS)],
+        [KeyboardButton(text=BTN_MY_STARS)],
+        [KeyboardButton(text=BTN_LOGOUT)]
+    ],
+    resize_keyboard=True
+)
+
 def get_main_parent_keyboard():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📝 Добавить задание")],
-            [KeyboardButton(text="🔄 Добавить недельные задания")],
-            [KeyboardButton(text="📊 Статистика")],
-            [KeyboardButton(text="💵 Наградить")],
-            [KeyboardButton(text="🚪 Выход")]
-        ],
-        resize_keyboard=True
-    )
+    return MAIN_PARENT_KEYBOARD
 
 def get_main_child_keyboard():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📋 Мои задания")],
-            [KeyboardButton(text="⭐ Мои звезды")],
-            [KeyboardButton(text="🚪 Выход")]
-        ],
-        resize_keyboard=True
-    )
+    return MAIN_CHILD_KEYBOARD
 
-def get_children_keyboard(children):
-    """Клавиатура для выбора ребенка"""
+# ДИНАМИЧЕСКИЕ КЛАВИАТУРЫ
+# Запоминаются по содержимому, которое попадает в разметку
+_keyboard_cache = LRUCache(maxsize=512)
+
+def _cached(kind, key, build):
+    cache_key = (kind, key)
+    keyboard = _keyboard_cache.get(cache_key)
+    if keyboard is MISSING:
+        keyboard = build(key)
+        _keyboard_cache.set(cache_key, keyboard)
+    return keyboard
+
+def _build_children_keyboard(children):
     keyboard_buttons = []
     for child in children:
         keyboard_buttons.append([KeyboardButton(text=child.capitalize())])
-    keyboard_buttons.append([KeyboardButton(text="🔙 Назад")])
+    keyboard_buttons.append([KeyboardButton(text=BTN_BACK)])
     
-    return ReplyKeyboardMarkup(
+    return FrozenReplyKeyboardMarkup(
         keyboard=keyboard_buttons,
         resize_keyboard=True
     )
 
-def get_tasks_keyboard(tasks):
-    """Клавиатура с заданиями"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+def get_children_keyboard(children):
+    """Клавиатура для выбора ребенка"""
+    return _cached("children", tuple(children), _build_children_keyboard)
+
+def page_callback_data(direction, cursor):
+    """callback_data кнопки листания: page:<направление><created_at>|<id>"""
+    created_at, task_id = cursor
+    return f"{PAGE_CALLBACK_PREFIX}{direction}{created_at}|{task_id}"
+
+def _build_tasks_keyboard(key):
+    tasks, prev_cursor, next_cursor = key
+    keyboard_buttons = []
+    for task_id, task_text, stars_reward, is_weekly in tasks:
+        emoji = "🔄 " if is_weekly else ""
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=f"{emoji}{task_text} (+{stars_reward}⭐)", 
+                callback_data=f"complete:{task_id}"
+            )
+        ])
     
-    for task in tasks:
-        task_id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at = task
-        if not is_completed:
-            emoji = "🔄 " if is_weekly else ""
-            keyboard.inline_keyboard.append([
-                InlineKeyboardButton(
-                    text=f"{emoji}{task_text} (+{stars_reward}⭐)", 
-                    callback_data=f"complete:{task_id}"
-                )
-            ])
+    navigation = []
+    if prev_cursor:
+        navigation.append(InlineKeyboardButton(text="⬅️", callback_data=page_callback_data("<", prev_cursor)))
+    if next_cursor:
+        navigation.append(InlineKeyboardButton(text="➡️", callback_data=page_callback_data(">", next_cursor)))
+    if navigation:
+        keyboard_buttons.append(navigation)
     
-    return keyboard
+    return FrozenInlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
-def get_reset_stars_keyboard(children_with_stars):
-    """Клавиатура для обнуления звезд"""
+def get_tasks_keyboard(tasks, prev_cursor=None, next_cursor=None):
+    """Клавиатура со страницей заданий (из Database.get_tasks_page)"""
+    rows = tuple(
+        (task_id, task_text, stars_reward, bool(is_weekly))
+        for task_id, task_text, stars_reward, is_weekly, created_at in tasks
+    )
+    return _cached("tasks", (rows, prev_cursor, next_cursor), _build_tasks_keyboard)
+
+def _build_reset_stars_keyboard(children_with_stars):
     keyboard_buttons = []
     for child_name, stars in children_with_stars:
-        keyboard_buttons.append([KeyboardButton(text=f"💵 {child_name.capitalize()} ({stars}⭐)")])
-    keyboard_buttons.append([KeyboardButton(text="🔙 Назад")])
+        keyboard_buttons.append([KeyboardButton(text=f"{BTN_REWARD_CHILD_PREFIX}{child_name.capitalize()} ({stars}⭐)")])
+    keyboard_buttons.append([KeyboardButton(text=BTN_BACK)])
     
-    return ReplyKeyboardMarkup(
+    return FrozenReplyKeyboardMarkup(
         keyboard=keyboard_buttons,
         resize_keyboard=True
-    )
\ No newline at end of file
+    )
+
+def get_reset_stars_keyboard(children_with_stars):
+    """Клавиатура для обнуления звезд"""
+    return _cached("reset_stars", tuple(children_with_stars), _build_reset_stars_keyboard)
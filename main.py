@@ -26,8 +26,63 @@ async def wait_for_internet():
     logger.error("❌ Не удалось установить интернет-подключение")
     return False
 
-async def main():
+def create_dispatcher(storage, db):
+    """Диспетчер со всеми роутерами бота"""
+    from aiogram import Dispatcher
+    
+    from handlers.common import router as common_router
+    from handlers.parent import router as parent_router
+    from handlers.child import router as child_router
+    from utils.session import SessionMiddleware
+    
+    # db передается в обработчики через workflow data диспетчера
+    dp = Dispatcher(storage=storage, db=db)
+    # Внешний middleware срабатывает до фильтров: они тоже получают member
+    session = SessionMiddleware()
+    dp.message.outer_middleware(session)
+    dp.callback_query.outer_middleware(session)
+    dp.include_router(common_router)
+    dp.include_router(parent_router)
+    dp.include_router(child_router)
+    return dp
+
+async def run_polling(bot, dp):
+    """Поллинг с перезапуском при сетевых ошибках"""
+    from aiogram.exceptions import TelegramNetworkError
+    
+    logger.info("🚀 Запуск поллинга бота")
+    
+    restart_count = 0
+    max_restarts = 5
+    
+    while restart_count < max_restarts:
+        try:
+            await dp.start_polling(bot)
+            break  # Если бот остановлен нормально
+            
+        except TelegramNetworkError as e:
+            restart_count += 1
+            logger.warning(f"📡 Сетевая ошибка (перезапуск {restart_count}/{max_restarts}): {e}")
+            
+            if restart_count < max_restarts:
+                wait_time = restart_count * 10  # Увеличиваем время ожидания
+                logger.info(f"⏳ Ожидание {wait_time} секунд перед перезапуском...")
+                await asyncio.sleep(wait_time)
+            else:
+                logger.error("❌ Достигнут лимит перезапусков из-за сетевых ошибок")
+                break
+                
+        except Exception as e:
+            logger.exception(f"❌ Непредвиденная ошибка: {e}")
+            break
+
+async def main(mode=None):
     """Основная функция запуска бота"""
+    db = None
+    storage = None
+    scheduler_task = None
+    outbound = None
+    notifier_task = None
     try:
         setup_logging()
         logger.info("🤖 Начало запуска бота")
@@ -39,17 +94,17 @@ async def main():
             return
         
         # Импорты после проверки подключения
-        from aiogram import Bot, Dispatcher
-        from aiogram.fsm.storage.memory import MemoryStorage
+        from aiogram import Bot
         from aiogram.exceptions import TelegramNetworkError
         
         import config
-        from database import Database
-        
-        # Импорт обработчиков
-        from handlers.common import router as common_router
-        from handlers.parent import router as parent_router
-        from handlers.child import router as child_router
+        from database import Database, AsyncDatabase, LEGACY_FAMILY_ID
+        from utils.events import EventBus
+        from utils.fsm_storage import create_storage
+        from utils.notifications import ParentNotifier
+        from utils.outbound import OutboundQueue
+        from utils.shards import ShardedDatabase
+        from utils.task_scheduler import create_scheduler
         
         # Проверка токена
         if config.BOT_TOKEN == "YOUR_BOT_TOKEN_HERE" or not config.BOT_TOKEN:
@@ -59,9 +114,22 @@ async def main():
             print("💡 Получите токен у @BotFather в Telegram")
             return
         
-        # Инициализация базы данных
+        mode = mode or config.RUN_MODE
+        if mode == "webhook" and not config.WEBHOOK_URL:
+            logger.error("❌ Для режима webhook нужен WEBHOOK_URL")
+            print("❌ Для режима webhook укажите WEBHOOK_URL (публичный https-адрес)")
+            return
+        
+        # Инициализация базы данных (единственный экземпляр на всё приложение)
         logger.info("📊 Инициализация базы данных")
-        db = Database()
+        # Выполнение заданий и награды публикуются в шину для уведомлений родителям
+        events = EventBus()
+        if config.DB_SHARDS > 1:
+            db = AsyncDatabase(ShardedDatabase(shards=config.DB_SHARDS, events=events))
+        else:
+            db = AsyncDatabase(Database(events=events))
+        # Пароли первой семьи по-прежнему задаются в конфигурации
+        await db.set_family_passwords(LEGACY_FAMILY_ID, config.PASSWORDS)
         
         # Инициализация бота с увеличенным таймаутом
         logger.info("🔧 Инициализация бота")
@@ -69,21 +137,22 @@ async def main():
             token=config.BOT_TOKEN,
             timeout=60  # Увеличиваем таймаут
         )
-        storage = MemoryStorage()
-        dp = Dispatcher(storage=storage)
+        # Все запросы к Telegram - через очередь с его лимитами отправки
+        outbound = OutboundQueue(global_rate=config.OUTBOUND_RATE, chat_rate=config.OUTBOUND_CHAT_RATE)
+        bot.session.middleware(outbound)
+        storage = create_storage(db)
         
         # Регистрация роутеров
         logger.info("🔄 Регистрация обработчиков")
-        dp.include_router(common_router)
-        dp.include_router(parent_router)
-        dp.include_router(child_router)
+        dp = create_dispatcher(storage, db)
         
         # Проверка подключения к Telegram
         try:
             logger.info("🔗 Проверка подключения к Telegram API...")
             bot_info = await bot.get_me()
             logger.info(f"✅ Бот инициализирован: @{bot_info.username} ({bot_info.first_name})")
-            logger.info(f"👥 Дети в системе: {', '.join(db.get_all_children())}")
+            families = await db.get_family_ids()
+            logger.info(f"👥 Семей в системе: {len(families)}")
             
             print("=" * 50)
             print("🤖 Бот успешно запущен!")
@@ -106,32 +175,26 @@ async def main():
             print("🔧 Проверьте токен бота в config.py")
             return
         
-        # Запуск бота с обработкой сетевых ошибок
-        logger.info("🚀 Запуск поллинга бота")
+        # Периодические задачи (обновление недельных заданий)
+        scheduler_task = asyncio.create_task(create_scheduler(db).run())
+        notifier = ParentNotifier(bot, db, events, delay=config.NOTIFY_DELAY, max_delay=config.NOTIFY_MAX_DELAY)
+        notifier_task = asyncio.create_task(notifier.run())
         
-        restart_count = 0
-        max_restarts = 5
-        
-        while restart_count < max_restarts:
-            try:
-                await dp.start_polling(bot)
-                break  # Если бот остановлен нормально
-                
-            except TelegramNetworkError as e:
-                restart_count += 1
-                logger.warning(f"📡 Сетевая ошибка (перезапуск {restart_count}/{max_restarts}): {e}")
-                
-                if restart_count < max_restarts:
-                    wait_time = restart_count * 10  # Увеличиваем время ожидания
-                    logger.info(f"⏳ Ожидание {wait_time} секунд перед перезапуском...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error("❌ Достигнут лимит перезапусков из-за сетевых ошибок")
-                    break
-                    
-            except Exception as e:
-                logger.exception(f"❌ Непредвиденная ошибка: {e}")
-                break
+        if mode == "webhook":
+            from utils.webhook import run_webhook
+            await run_webhook(
+                bot, dp,
+                base_url=config.WEBHOOK_URL,
+                path=config.WEBHOOK_PATH,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                secret_token=config.WEBHOOK_SECRET,
+                max_concurrency=config.WEBHOOK_MAX_CONCURRENCY,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            )
+        else:
+            # Запуск бота с обработкой сетевых ошибок
+            await run_polling(bot, dp)
         
     except ImportError as e:
         logger.error(f"❌ Ошибка импорта: {e}")
@@ -143,11 +206,45 @@ async def main():
         print(f"❌ Критическая ошибка: {e}")
         
     finally:
+        if scheduler_task is not None:
+            scheduler_task.cancel()
+            try:
+                await scheduler_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.exception(f"❌ Ошибка планировщика: {e}")
+        if notifier_task is not None:
+            # Накопленные сводки отправляются при отмене
+            notifier_task.cancel()
+            try:
+                await notifier_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.exception(f"❌ Ошибка уведомлений: {e}")
+        if outbound is not None:
+            await outbound.close()
+            logger.info(f"📤 Отправлено: {outbound.sent}, объединено правок: {outbound.coalesced}, "
+                        f"ожиданий по лимиту: {outbound.flood_waits}")
+        if storage is not None:
+            await storage.close()
+        if db is not None:
+            logger.info(f"🗂 Кэш сессий: {db.session_cache.stats()}")
+            logger.info(f"🗂 Кэш чтения: {db.read_cache.stats()}")
+            await db.close()
+            logger.info("📊 Соединения с базой данных закрыты")
         logger.info("👋 Завершение работы бота")
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Бот управления заданиями")
+    parser.add_argument("--mode", choices=["polling", "webhook"], help="режим получения апдейтов (по умолчанию RUN_MODE)")
+    args = parser.parse_args()
+    
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.mode))
     except KeyboardInterrupt:
         logger.info("⏹️  Бот остановлен пользователем")
         print("\n👋 Бот остановлен")
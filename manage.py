@@ -0,0 +1,116 @@
+"""Управление семьями бота из командной строки.
+
+Примеры:
+    python manage.py families
+    python manage.py add-family "Ивановы"
+    python manage.py add-member 2 маша --password секрет
+    python manage.py add-member 2 мама --parent --password секрет2
+    python manage.py members 2
+    python manage.py set-password 7 новый-пароль
+    python manage.py add-weekly-task 5 "Прочитать книгу" 10
+    python manage.py weekly-tasks 2
+    python manage.py --shards 4 rebalance --dry-run
+"""
+import argparse
+import sqlite3
+import sys
+
+from database import Database
+from utils.shards import ShardedDatabase
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Управление семьями бота")
+    parser.add_argument("--db", default="bot.db", help="путь к базе (по умолчанию bot.db)")
+    parser.add_argument("--shards", type=int, default=1, help="число шардов, как DB_SHARDS бота")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("families", help="список семей")
+
+    add_family = commands.add_parser("add-family", help="создать семью")
+    add_family.add_argument("name")
+
+    add_member = commands.add_parser("add-member", help="добавить участника семьи")
+    add_member.add_argument("family_id", type=int)
+    add_member.add_argument("name")
+    add_member.add_argument("--parent", action="store_true", help="родитель (по умолчанию - ребенок)")
+    add_member.add_argument("--password", help="пароль для входа")
+
+    members = commands.add_parser("members", help="участники семьи")
+    members.add_argument("family_id", type=int)
+
+    set_password = commands.add_parser("set-password", help="задать пароль участника")
+    set_password.add_argument("member_id", type=int)
+    set_password.add_argument("password")
+
+    weekly_tasks = commands.add_parser("weekly-tasks", help="шаблоны недельных заданий семьи")
+    weekly_tasks.add_argument("family_id", type=int)
+
+    add_weekly_task = commands.add_parser("add-weekly-task", help="добавить ребенку шаблон недельного задания")
+    add_weekly_task.add_argument("member_id", type=int)
+    add_weekly_task.add_argument("text")
+    add_weekly_task.add_argument("stars", type=int)
+
+    delete_weekly_task = commands.add_parser("delete-weekly-task", help="удалить шаблон недельного задания")
+    delete_weekly_task.add_argument("family_id", type=int)
+    delete_weekly_task.add_argument("template_id", type=int)
+
+    rebalance = commands.add_parser("rebalance", help="разложить семьи по шардам (бот должен быть остановлен)")
+    rebalance.add_argument("--dry-run", action="store_true", help="только показать переносы")
+
+    args = parser.parse_args()
+    db = ShardedDatabase(args.db, shards=args.shards) if args.shards > 1 else Database(args.db)
+    try:
+        if args.command == "families":
+            for family_id, name, member_count in db.get_families():
+                print(f"{family_id:6}  {name}  (участников: {member_count})")
+
+        elif args.command == "add-family":
+            print(f"✅ Семья создана, id {db.create_family(args.name)}")
+
+        elif args.command == "add-member":
+            role = "parent" if args.parent else "child"
+            member_id = db.add_member(args.family_id, args.name, role, args.password)
+            print(f"✅ Участник добавлен, id {member_id}, вход: {args.family_id} {args.name.lower()}")
+
+        elif args.command == "members":
+            for member_id, name, role in db.get_members(args.family_id):
+                print(f"{member_id:6}  {name}  ({role})")
+
+        elif args.command == "set-password":
+            if not db.set_member_password(args.member_id, args.password):
+                sys.exit("❌ Участник не найден")
+            print("✅ Пароль изменен")
+
+        elif args.command == "weekly-tasks":
+            for template_id, child_name, text, stars in db.get_weekly_templates(args.family_id):
+                print(f"{template_id:6}  {child_name}: {text} ({stars}⭐)")
+
+        elif args.command == "add-weekly-task":
+            template_id = db.add_weekly_template(args.member_id, args.text, args.stars)
+            if template_id is None:
+                sys.exit("❌ Ребенок не найден")
+            print(f"✅ Шаблон добавлен, id {template_id}")
+
+        elif args.command == "delete-weekly-task":
+            if not db.delete_weekly_template(args.family_id, args.template_id):
+                sys.exit("❌ Шаблон не найден")
+            print("✅ Шаблон удален")
+
+        elif args.command == "rebalance":
+            if args.shards < 2:
+                sys.exit("❌ Укажите число шардов: --shards N")
+            moves = db.plan_rebalance() if args.dry_run else db.rebalance()
+            for family_id, source, target in moves:
+                print(f"семья {family_id}: шард {source} -> {target}")
+            print(f"{'Нужно перенести' if args.dry_run else '✅ Перенесено'} семей: {len(moves)}")
+
+    except sqlite3.IntegrityError:
+        # Имя уникально в семье: по нему и номеру семьи участник входит
+        sys.exit("❌ Такое имя в семье уже есть")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from aiogram import Router, types
+from aiogram.dispatcher.event.handler import CallableObject
+
+
+class ButtonRouter:
+    """Индекс "текст кнопки -> обработчик" для reply-клавиатур.
+
+    Вместо цепочки фильтров ``message.text == "..."``, которые aiogram
+    проверяет по очереди, роутер получает один обработчик сообщений,
+    а нажатие кнопки находится одним поиском в словаре.
+    """
+
+    def __init__(self, router: Router):
+        self.router = router
+        self._handlers = {}
+        # Кнопки с переменной частью ("💵 Имя (5⭐)"), проверяются после точных
+        self._prefixes = []
+
+    def button(self, *texts):
+        """Декоратор: обработчик нажатия кнопок с указанными текстами"""
+        def decorator(callback):
+            handler = CallableObject(callback)
+            for text in texts:
+                if text in self._handlers:
+                    raise ValueError(f"Кнопка {text!r} уже зарегистрирована")
+                self._handlers[text] = handler
+            return callback
+        return decorator
+
+    def prefix(self, text):
+        """Декоратор: обработчик кнопок, текст которых начинается с text"""
+        def decorator(callback):
+            self._prefixes.append((text, CallableObject(callback)))
+            return callback
+        return decorator
+
+    def register(self):
+        """Подключить индекс к роутеру.
+
+        Вызывается после объявления обработчиков состояний, чтобы ввод
+        в середине диалога, как и раньше, доставался им.
+        """
+        self.router.message(self._match)(self._dispatch)
+
+    async def _match(self, message: types.Message):
+        # Асинхронный: синхронный фильтр aiogram запускал бы в отдельном потоке
+        text = message.text
+        if text is None:
+            return False
+
+        handler = self._handlers.get(text)
+        if handler is None:
+            handler = next((h for prefix, h in self._prefixes if text.startswith(prefix)), None)
+        if handler is None:
+            return False
+        return {"button_handler": handler}
+
+    async def _dispatch(self, message: types.Message, button_handler: CallableObject, **kwargs):
+        # CallableObject сам отберет из kwargs аргументы, нужные обработчику
+        return await button_handler.call(message, **kwargs)
+
+
+def callback_prefix(prefix):
+    """Фильтр callback-запросов, данные которых начинаются с prefix.
+
+    Асинхронный по той же причине, что и ButtonRouter._match: лямбда
+    или F.data.startswith(...) проверялись бы через asyncio.to_thread.
+    """
+    async def check(callback: types.CallbackQuery):
+        return callback.data is not None and callback.data.startswith(prefix)
+    return check
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """Шина событий между потоком базы и event loop.
+
+    publish() можно вызывать из любого потока (Database публикует из
+    своего): событие - словарь с ключом "type" - раскладывается по
+    очередям подписчиков в их event loop. Переполненная очередь
+    медленного подписчика теряет события, а не тормозит запись в базу.
+    """
+
+    def __init__(self):
+        # (event loop, очередь) подписчиков
+        self._subscribers = []
+        self.dropped = 0
+
+    def subscribe(self, maxsize=10000):
+        """Очередь событий для подписчика в текущем event loop"""
+        queue = asyncio.Queue(maxsize)
+        self._subscribers.append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers = [(loop, q) for loop, q in self._subscribers if q is not queue]
+
+    def publish(self, event):
+        for loop, queue in self._subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, event)
+            except RuntimeError:
+                # Event loop уже закрыт: бот останавливается
+                pass
+
+    def _offer(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"⚠️ Очередь событий переполнена, событие {event['type']} потеряно")
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+import config
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в таблице fsm_states базы бота.
+
+    Изменения копятся в памяти и записываются пачкой раз в flush_interval
+    секунд одной транзакцией, чтение сначала смотрит в этот буфер.
+    Состояния, не менявшиеся дольше state_ttl секунд, считаются пустыми
+    и периодически удаляются.
+    """
+
+    def __init__(self, db: AsyncDatabase, state_ttl=24 * 60 * 60, flush_interval=0.5, purge_interval=60 * 60):
+        self.db = db
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        # key -> (state, data_json, updated_at), еще не записанные в базу
+        self._pending = {}
+        self._flush_task = None
+        self._last_purge = time.time()
+
+    @staticmethod
+    def _build_key(key: StorageKey):
+        parts = (
+            key.bot_id, key.chat_id, key.user_id,
+            key.thread_id, key.business_connection_id, key.destiny,
+        )
+        return ":".join("" if part is None else str(part) for part in parts)
+
+    async def _load(self, key):
+        """Текущие (state, data_json) с учетом буфера и TTL"""
+        record = self._pending.get(key)
+        if record is None:
+            record = await self.db.get_fsm_record(key)
+        if record is None or record[2] < time.time() - self.state_ttl:
+            return None, "{}"
+        return record[0], record[1]
+
+    async def _store(self, key, state, data):
+        self._pending[key] = (state, data, time.time())
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Записи остались в буфере: повторим через flush_interval
+                logger.exception("❌ Не удалось записать состояния FSM")
+
+    async def flush(self):
+        """Записать накопленные изменения в базу"""
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            try:
+                await self.db.save_fsm_records([(key, *record) for key, record in pending.items()])
+            except BaseException:
+                # Возвращаем в буфер (и при отмене на остановке), не затирая
+                # изменения, сделанные во время записи
+                for key, record in pending.items():
+                    self._pending.setdefault(key, record)
+                raise
+
+        now = time.time()
+        if now - self._last_purge >= self.purge_interval:
+            self._last_purge = now
+            removed = await self.db.delete_expired_fsm_records(now - self.state_ttl)
+            if removed:
+                logger.info(f"🧹 Удалено устаревших состояний FSM: {removed}")
+
+    async def set_state(self, key: StorageKey, state=None):
+        key = self._build_key(key)
+        _, data = await self._load(key)
+        await self._store(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey):
+        state, _ = await self._load(self._build_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data):
+        key = self._build_key(key)
+        state, _ = await self._load(key)
+        await self._store(key, state, json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey):
+        _, data = await self._load(self._build_key(key))
+        return json.loads(data)
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            # Дожидаемся отмены: прерванная запись успевает вернуть записи в буфер
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        await self.flush()
+
+
+def create_storage(db: AsyncDatabase):
+    """Хранилище FSM по настройке config.FSM_STORAGE"""
+    if config.FSM_STORAGE == "memory":
+        from aiogram.fsm.storage.memory import MemoryStorage
+        return MemoryStorage()
+
+    if config.FSM_STORAGE == "redis":
+        # Требует пакет redis; подойдет любой сервер с протоколом Redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            config.REDIS_URL,
+            state_ttl=config.FSM_STATE_TTL,
+            data_ttl=config.FSM_STATE_TTL,
+        )
+
+    return SQLiteStorage(db, state_ttl=config.FSM_STATE_TTL)
@@ -0,0 +1,113 @@
+import asyncio
+import html
+import logging
+from collections import defaultdict
+
+from aiogram.exceptions import TelegramAPIError
+
+from database import AsyncDatabase
+from utils.events import EventBus
+
+logger = logging.getLogger(__name__)
+
+# Сколько выполненных заданий ребенка перечислять в сводке
+TASKS_PER_CHILD = 5
+
+
+def render_digest(events):
+    """Текст сводки по событиям одной семьи (HTML)"""
+    completed = defaultdict(list)
+    resets = []
+    for event in events:
+        if event["type"] == "task_completed":
+            completed[event["child_name"]].append(event)
+        elif event["type"] == "stars_reset":
+            resets.append(event)
+
+    lines = ["🔔 <b>Новости семьи</b>", ""]
+    for child_name, tasks in completed.items():
+        stars = sum(task["stars"] for task in tasks)
+        lines.append(f"👤 <b>{html.escape(child_name.capitalize())}</b>: выполнено {len(tasks)} (+{stars}⭐)")
+        for task in tasks[:TASKS_PER_CHILD]:
+            lines.append(f"   ✅ {html.escape(task['task_text'])} ({task['stars']}⭐)")
+        if len(tasks) > TASKS_PER_CHILD:
+            lines.append(f"   … и еще {len(tasks) - TASKS_PER_CHILD}")
+    for reset in resets:
+        lines.append(f"💵 {html.escape(reset['child_name'].capitalize())} награжден(а): {reset['stars']}⭐")
+    return "\n".join(lines)
+
+
+class ParentNotifier:
+    """Сводки родителям о выполненных заданиях и наградах.
+
+    События семьи копятся, пока идут подряд: сводка уходит через delay
+    секунд тишины, но не позже max_delay после первого события, поэтому
+    серия нажатий ребенка дает одно сообщение. Получатели - все, кто
+    сейчас вошел как родитель этой семьи.
+    """
+
+    def __init__(self, bot, db: AsyncDatabase, events: EventBus, delay=30, max_delay=300):
+        self.bot = bot
+        self.db = db
+        self.events = events
+        self.delay = delay
+        self.max_delay = max_delay
+        # id семьи -> [время первого события, время последнего, события]
+        self._pending = {}
+        self.sent = 0
+
+    def _add(self, event, now):
+        if event["family_id"] is None:
+            return
+        batch = self._pending.get(event["family_id"])
+        if batch is None:
+            self._pending[event["family_id"]] = [now, now, [event]]
+        else:
+            batch[1] = now
+            batch[2].append(event)
+
+    def _due(self, batch):
+        first_at, last_at, _ = batch
+        return min(last_at + self.delay, first_at + self.max_delay)
+
+    async def _flush(self, now=None):
+        """Отправить сводки, время которых пришло (now=None - все)"""
+        for family_id, batch in list(self._pending.items()):
+            if now is None or self._due(batch) <= now:
+                del self._pending[family_id]
+                try:
+                    await self._notify(family_id, batch[2])
+                except Exception:
+                    logger.exception(f"❌ Сводка семье {family_id} не отправлена")
+
+    async def _notify(self, family_id, events):
+        text = render_digest(events)
+        for telegram_id in await self.db.get_parent_sessions(family_id):
+            try:
+                await self.bot.send_message(telegram_id, text, parse_mode="HTML")
+                self.sent += 1
+            except TelegramAPIError as e:
+                # Родитель заблокировал бота или чат недоступен: остальным отправляем
+                logger.warning(f"⚠️ Сводка родителю {telegram_id} не отправлена: {e}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        queue = self.events.subscribe()
+        try:
+            while True:
+                timeout = None
+                if self._pending:
+                    timeout = max(0, min(self._due(batch) for batch in self._pending.values()) - loop.time())
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    self._add(event, loop.time())
+                await self._flush(loop.time())
+        except asyncio.CancelledError:
+            # Остановка бота: накопленное отправляем сразу
+            await self._flush()
+            raise
+        finally:
+            self.events.unsubscribe(queue)
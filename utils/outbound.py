@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageCaption, EditMessageReplyMarkup, EditMessageText
+
+from utils.cache import LRUCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# Правки сообщения: из нескольких ожидающих отправки важна только последняя
+_EDIT_METHODS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, в запасе не больше capacity.
+
+    reserve() сразу списывает токен и возвращает, сколько ждать своей
+    очереди: запас уходит в минус, поэтому одновременные отправители
+    расходятся по времени без блокировок. delay() только говорит, когда
+    появится токен, - для ведра с единственным отправителем.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def delay(self):
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Request:
+    __slots__ = ("make_request", "bot", "method", "edit_key", "future")
+
+    def __init__(self, make_request, bot, method, edit_key):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.edit_key = edit_key
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    """Очередь исходящих запросов к Telegram с учетом его лимитов.
+
+    Подключается к сессии бота, поэтому через нее идут все ответы
+    обработчиков (message.answer, edit_text и т.п.). Запросы с chat_id
+    встают в очередь своего чата и отправляются по порядку: не чаще
+    chat_rate в секунду на чат (group_rate - для групп) и global_rate
+    на весь бот. На 429 очередь чата ждет retry_after и повторяет
+    запрос, остальные чаты продолжают отправку. Ожидающая правка
+    сообщения заменяется более новой правкой того же сообщения, оба
+    вызова получают результат последней. Запросы без чата (getUpdates,
+    answerCallbackQuery) идут напрямую.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, group_rate=20 / 60, chat_burst=3, max_retries=3):
+        # Общий лимит без запаса на всплеск: отправки идут ровно, иначе после
+        # паузы в первую секунду ушло бы вдвое больше global_rate
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        # Ведро чата переживает его очередь: лимит действует и между пачками ответов
+        self._chat_buckets = LRUCache(maxsize=10000)
+        self._queues = {}
+        # (чат, сообщение) -> еще не отправленная правка
+        self._edits = {}
+        self._workers = set()
+        self.sent = 0
+        self.coalesced = 0
+        self.flood_waits = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        edit_key = None
+        if isinstance(method, _EDIT_METHODS) and method.message_id is not None:
+            edit_key = (chat_id, method.message_id)
+            pending = self._edits.get(edit_key)
+            if pending is not None:
+                pending.make_request, pending.bot, pending.method = make_request, bot, method
+                self.coalesced += 1
+                return await asyncio.shield(pending.future)
+
+        request = _Request(make_request, bot, method, edit_key)
+        if edit_key is not None:
+            self._edits[edit_key] = request
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            worker = asyncio.create_task(self._worker(chat_id, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.append(request)
+        # Отмена обработчика не отменяет отправку: запрос мог забрать чужую правку
+        return await asyncio.shield(request.future)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is MISSING:
+            # У личных чатов id положительный, у групп и каналов - отрицательный
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self.chat_rate if is_private else self.group_rate, self.chat_burst)
+            self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    async def _worker(self, chat_id, queue):
+        """Отправить очередь чата по порядку и завершиться, когда она опустеет"""
+        bucket = self._chat_bucket(chat_id)
+        try:
+            while queue:
+                # Токен чата списывается в момент отправки, а не до ожидания
+                # общей очереди: иначе после долгого ожидания два сообщения
+                # ушли бы в чат почти одновременно
+                await asyncio.sleep(bucket.delay())
+                await asyncio.sleep(self.global_bucket.reserve())
+                bucket.reserve()
+                request = queue.popleft()
+                # С этого момента правка уже не заменяется
+                if request.edit_key is not None:
+                    del self._edits[request.edit_key]
+                try:
+                    result = await self._send(request)
+                except asyncio.CancelledError:
+                    request.future.cancel()
+                    raise
+                except Exception as e:
+                    request.future.set_exception(e)
+                else:
+                    request.future.set_result(result)
+        finally:
+            del self._queues[chat_id]
+            # Воркер отменен при остановке: неотправленные запросы не ждут вечно
+            for request in queue:
+                request.future.cancel()
+                if request.edit_key is not None:
+                    del self._edits[request.edit_key]
+
+    async def _send(self, request):
+        attempt = 0
+        while True:
+            try:
+                result = await request.make_request(request.bot, request.method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.flood_waits += 1
+                logger.warning(f"⏳ Лимит Telegram для чата {request.method.chat_id}: ждем {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+                # Повтор - такая же отправка и тоже ждет общей очереди
+                await asyncio.sleep(self.global_bucket.reserve())
+
+    async def close(self):
+        """Дождаться отправки всего, что уже в очередях"""
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
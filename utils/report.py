@@ -0,0 +1,134 @@
+import html
+import threading
+from datetime import datetime
+
+from database import Database
+from utils.cache import LRUCache, MISSING
+
+# Лимит Telegram - 4096 символов после разбора HTML в единицах UTF-16,
+# эмодзи занимают по две: оставляем запас
+MESSAGE_LIMIT = 3500
+# Текст задания в отчете обрезается до экранирования: даже целиком из
+# "&" (5 символов после html.escape) строка задания влезает в сообщение
+TASK_TEXT_LIMIT = 500
+
+
+def _task_text(text):
+    """Текст задания для HTML-отчета: обрезанный и экранированный"""
+    if len(text) > TASK_TEXT_LIMIT:
+        text = text[:TASK_TEXT_LIMIT - 1] + "…"
+    return html.escape(text)
+
+
+def _cut_position(block, limit):
+    """Где разрезать HTML не дальше limit: не внутри тега и не внутри &amp;-сущности"""
+    position = limit
+    tag_start = block.rfind("<", 0, position)
+    if tag_start > block.rfind(">", 0, position):
+        position = tag_start
+    entity_start = block.rfind("&", 0, position)
+    if entity_start != -1 and block.find(";", entity_start, position) == -1:
+        position = entity_start
+    return position or limit
+
+
+def iter_statistics_report(db: Database, family_id):
+    """Отчет "Задания и статистика" по семье блоками по строке.
+
+    Открытые задания берутся из курсора по одному, поэтому отчет
+    не держит в памяти весь список заданий.
+    """
+    stats = db.get_statistics(family_id)
+
+    yield "📋 <b>Задания и статистика</b>\n\n"
+
+    # Общая статистика
+    yield (
+        f"✅ Выполнено: <b>{stats['total_completed']}</b>\n"
+        f"📝 Ожидает выполнения: <b>{stats['total_pending']}</b>\n\n"
+    )
+
+    # По детям
+    for child_name, child_stats in stats["children"].items():
+        yield (
+            f"👤 <b>{html.escape(child_name.capitalize())}</b>\n"
+            f"   ✅ {child_stats['completed']} | 📝 {child_stats['pending']} | ⭐ {child_stats['stars']}\n\n"
+        )
+
+    # Последние выполненные задания
+    recent_tasks_all = []
+    for child_name, child_stats in stats["children"].items():
+        recent_tasks_all.extend(child_stats["recent_tasks"])
+
+    recent_tasks_all.sort(key=lambda x: x[6] or "", reverse=True)
+    recent_tasks = recent_tasks_all[:5]
+
+    if recent_tasks:
+        yield "🕒 <b>Последние выполненные:</b>\n"
+        for task in recent_tasks:
+            task_id, child_name, task_text, stars_reward, is_completed, is_weekly, completed_at, created_at = task
+            if completed_at:
+                try:
+                    dt = datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
+                    time_str = dt.strftime("%d.%m %H:%M")
+                except ValueError:
+                    time_str = "недавно"
+                yield f"   {html.escape(child_name.capitalize())}: {_task_text(task_text)} ({stars_reward}⭐, {time_str})\n"
+        yield "\n"
+
+    # Список текущих активных заданий
+    current_child = None
+    for child_name, task_text, stars_reward in db.iter_open_tasks(family_id):
+        if current_child is None:
+            yield "📝 <b>Активные задания:</b>\n\n"
+        if child_name != current_child:
+            if current_child is not None:
+                yield "\n"
+            current_child = child_name
+            yield f"👶 {html.escape(child_name.capitalize())}:\n"
+        yield f"   - {_task_text(task_text)} ({stars_reward}⭐)\n"
+
+    if current_child is None:
+        yield "❌ Активных заданий нет.\n"
+    else:
+        yield "\n"
+
+
+def split_messages(blocks, limit=MESSAGE_LIMIT):
+    """Склеить блоки в сообщения не длиннее limit, не разрывая блоки"""
+    chunk = ""
+    for block in blocks:
+        if chunk and len(chunk) + len(block) > limit:
+            if chunk.strip():
+                yield chunk
+            chunk = ""
+        # Тексты заданий уже обрезаны; блок длиннее лимита режем, не разрывая
+        # теги и сущности HTML, иначе Telegram не разберет сообщение
+        while len(block) > limit:
+            position = _cut_position(block, limit)
+            yield block[:position]
+            block = block[position:]
+        chunk += block
+    if chunk.strip():
+        yield chunk
+
+
+class StatisticsReport:
+    """Готовые отчеты семей, пересобираемые только при смене версии данных семьи"""
+
+    def __init__(self, maxsize=1024):
+        self._lock = threading.Lock()
+        # family_id -> (версия данных семьи, сообщения)
+        self._reports = LRUCache(maxsize=maxsize)
+
+    def render(self, db: Database, family_id):
+        """Список сообщений отчета. Вызывается в потоке базы данных."""
+        with self._lock:
+            # Версию читаем до сборки: изменение во время сборки
+            # даст новую версию и отчет пересоберется при следующем запросе
+            version = db.family_version(family_id)
+            report = self._reports.get(family_id)
+            if report is MISSING or report[0] != version:
+                report = (version, list(split_messages(iter_statistics_report(db, family_id))))
+                self._reports.set(family_id, report)
+            return report[1]
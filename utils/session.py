@@ -0,0 +1,34 @@
+from aiogram import BaseMiddleware
+
+
+class SessionMiddleware(BaseMiddleware):
+    """Участник семьи текущего пользователя в данных апдейта (ключ member).
+
+    Сессия читается один раз на апдейт (обычно из кэша сессий базы),
+    фильтры и обработчики получают ее аргументом ``member``: словарь
+    {"id", "family_id", "name", "role"} или None, если вход не выполнен.
+    """
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        data["member"] = await data["db"].get_current_user(user.id) if user else None
+        return await handler(event, data)
+
+
+def is_parent(member):
+    """Вошел родитель"""
+    return member is not None and member["role"] == "parent"
+
+
+def is_child(member):
+    """Вошел ребенок"""
+    return member is not None and member["role"] == "child"
+
+
+async def parent_only(event, member):
+    """Фильтр роутера: только для вошедшего родителя.
+
+    Событие приходит первым аргументом. Фильтр асинхронный: синхронный
+    aiogram запускал бы в отдельном потоке на каждом апдейте.
+    """
+    return is_parent(member)
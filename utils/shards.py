@@ -0,0 +1,367 @@
+import bisect
+import functools
+import hashlib
+import os
+import threading
+
+from database import Database
+
+# Диапазон id, который выдает каждый шард в таблицах с AUTOINCREMENT: шард k
+# нумерует с k * SHARD_ID_SPAN. Строки переезжают между шардами со своими id,
+# поэтому id заданий и записей журнала уникальны во всех файлах сразу
+SHARD_ID_SPAN = 10 ** 12
+_SEQUENCE_TABLES = ("tasks", "star_resets", "star_transactions", "weekly_templates")
+
+# Таблицы с данными семьи, которые переезжают вместе с ней (по id детей)
+_CHILD_TABLES = (
+    "tasks", "tasks_archive", "star_resets", "star_resets_archive", "star_transactions", "weekly_templates",
+)
+
+
+def shard_path(db_path, index):
+    """Файл шарда: bot.db для нулевого, bot.1.db, bot.2.db ... для остальных"""
+    if index == 0:
+        return db_path
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.{index}{ext}"
+
+
+class HashRing:
+    """Консистентное хэширование: ключ -> шард.
+
+    У каждого шарда vnodes точек на кольце, поэтому при добавлении шарда
+    новое место получает лишь примерно 1/N ключей.
+    """
+
+    def __init__(self, shards, vnodes=64):
+        points = sorted(
+            (self._hash(f"{shard}:{i}"), shard)
+            for shard in shards
+            for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], "big")
+
+    def lookup(self, key):
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._shards[index]
+
+
+class ShardedDatabase:
+    """Данные семей в нескольких файлах SQLite с маршрутизацией запросов.
+
+    Нулевой шард - основная база (bot.db): в ней справочник семей и
+    участников с паролями, сессии, состояния FSM, задачи планировщика
+    и таблица family_shards - где лежит каждая семья. Задания, звезды
+    и журнал семьи живут целиком в одном шарде, поэтому записи разных
+    семей не ждут общую блокировку записи SQLite. Новая семья попадает
+    в шард по консистентному хэшу своего id, прежние семьи без записи
+    в family_shards остаются в основной базе до rebalance().
+
+    Методы те же, что у Database: методы семьи и ребенка уходят в шард
+    семьи, остальные - в основную базу.
+    """
+
+    # Методы Database, первый аргумент которых - id семьи
+    FAMILY_METHODS = frozenset({
+        "get_all_children", "get_child_id", "get_children_stars", "family_version",
+        "seed_weekly_tasks", "iter_open_tasks",
+        "get_active_completed_tasks", "get_statistics", "get_weekly_templates", "delete_weekly_template",
+    })
+    # Методы Database, первый аргумент которых - id ребенка
+    CHILD_METHODS = frozenset({
+        "get_child_stars", "reset_child_stars", "get_child_summary", "get_last_reset_time",
+        "add_task", "get_tasks", "get_tasks_page", "get_active_completed_tasks_for_child",
+        "get_pending_reward_tasks", "add_weekly_template",
+    })
+
+    def __init__(self, db_path="bot.db", shards=1, **kwargs):
+        self.db_path = db_path
+        self.shards = []
+        for index in range(shards):
+            shard = Database(shard_path(db_path, index), **kwargs)
+            if index:
+                _prepare_shard(shard, index)
+            self.shards.append(shard)
+        self.home = self.shards[0]
+        self.ring = HashRing(range(shards))
+        # id семьи -> номер шарда; известные размещения читаются сразу, чтобы
+        # маршрутизация вызовов обычно обходилась без запроса к базе
+        cursor = self.home._get_connection().cursor()
+        cursor.execute('SELECT family_id, shard FROM family_shards')
+        self._placement = dict(cursor.fetchall())
+        self._lock = threading.Lock()
+
+    @property
+    def shard_count(self):
+        return len(self.shards)
+
+    def shard_of_family(self, family_id):
+        """Номер шарда семьи (семьи без записи - в основной базе)"""
+        shard = self._placement.get(family_id)
+        if shard is None:
+            cursor = self.home._get_connection().cursor()
+            cursor.execute('SELECT shard FROM family_shards WHERE family_id = ?', (family_id,))
+            result = cursor.fetchone()
+            shard = result[0] if result else 0
+            if shard >= len(self.shards):
+                raise RuntimeError(f"Семья {family_id} лежит в шарде {shard}, а открыто шардов: {len(self.shards)}")
+            self._placement[family_id] = shard
+        return shard
+
+    def shard_of_member(self, member_id):
+        family_id = self.home._family_of(member_id)
+        return 0 if family_id is None else self.shard_of_family(family_id)
+
+    def _routing_key(self, name, args):
+        """Чем определяется шард вызова: ("family" | "member", id) или None - основная база"""
+        if not args:
+            return None
+        if name in self.FAMILY_METHODS:
+            return "family", args[0]
+        if name in self.CHILD_METHODS:
+            return "member", args[0]
+        if name == "complete_task":
+            return "member", args[1]
+        return None
+
+    def shard_of_call(self, name, args):
+        """Номер шарда, в котором выполнится метод name с аргументами args.
+
+        Промах кэша размещения стоит одного чтения по первичному ключу
+        из основной базы.
+        """
+        key = self._routing_key(name, args)
+        if key is None:
+            return 0
+        kind, key_id = key
+        return self.shard_of_family(key_id) if kind == "family" else self.shard_of_member(key_id)
+
+    def peek_shard_of_family(self, family_id):
+        """Шард семьи только из кэша размещения (None - нужен shard_of_family)"""
+        return self._placement.get(family_id)
+
+    def peek_shard_of_call(self, name, args):
+        """Как shard_of_call, но только из кэшей, без запросов к базе: для
+        event loop. None - промах, шард определит shard_of_call в потоке базы."""
+        key = self._routing_key(name, args)
+        if key is None:
+            return 0
+        kind, key_id = key
+        if kind == "member":
+            if key_id is None:
+                return 0
+            key_id = self.home._member_families.get(key_id)
+            if key_id is None:
+                return None
+        return self._placement.get(key_id)
+
+    def for_family(self, family_id):
+        return self.shards[self.shard_of_family(family_id)]
+
+    def __getattr__(self, name):
+        attr = getattr(self.home, name)
+        if name in self.FAMILY_METHODS or name in self.CHILD_METHODS:
+            @functools.wraps(attr)
+            def method(*args, **kwargs):
+                shard = self.shards[self.shard_of_call(name, args)]
+                return getattr(shard, name)(*args, **kwargs)
+
+            setattr(self, name, method)
+            return method
+        return attr
+
+    def complete_task(self, task_id, child_id):
+        return self.shards[self.shard_of_member(child_id)].complete_task(task_id, child_id)
+
+    # СЕМЬИ
+    def create_family(self, name):
+        """Создать семью в шарде по хэшу ее id, вернуть id"""
+        family_id = self.home.create_family(name)
+        shard = self.ring.lookup(family_id)
+        self._set_placement(family_id, shard)
+        if shard:
+            self.shards[shard].create_family(name, family_id)
+        return family_id
+
+    def add_member(self, family_id, name, role="child", password=None):
+        """Добавить участника: id и пароль - в основной базе, данные - в шарде семьи"""
+        member_id = self.home.add_member(family_id, name, role, password)
+        shard = self.shard_of_family(family_id)
+        if shard:
+            self.shards[shard].add_member(family_id, name, role, member_id=member_id)
+        return member_id
+
+    def _set_placement(self, family_id, shard):
+        conn = self.home._get_connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO family_shards (family_id, shard) VALUES (?, ?)',
+            (family_id, shard)
+        )
+        conn.commit()
+        self._placement[family_id] = shard
+
+    # ОБСЛУЖИВАНИЕ: по всем шардам
+    def delete_weekly_tasks(self, keep_week=None):
+        for shard in self.shards:
+            shard.delete_weekly_tasks(keep_week)
+
+    def archive_history(self, keep_days=28, batch_size=500):
+        moved = [shard.archive_history(keep_days, batch_size) for shard in self.shards]
+        return sum(tasks for tasks, _ in moved), sum(resets for _, resets in moved)
+
+    def compact(self, pages=1000):
+        for shard in self.shards:
+            shard.compact(pages)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    # ПЕРЕНОС СЕМЕЙ
+    def plan_rebalance(self):
+        """Семьи не в своем по хэшу шарде: [(id семьи, откуда, куда)]"""
+        moves = []
+        for family_id in self.home.get_family_ids():
+            source, target = self.shard_of_family(family_id), self.ring.lookup(family_id)
+            if source != target:
+                moves.append((family_id, source, target))
+        return moves
+
+    def rebalance(self):
+        """Перенести семьи в шарды по хэшу (после добавления шардов или
+        перехода с одной базы). Запускать при остановленном боте.
+        Возвращает список переносов, как plan_rebalance().
+        """
+        moves = self.plan_rebalance()
+        for family_id, _, target in moves:
+            self.move_family(family_id, target)
+        return moves
+
+    def move_family(self, family_id, target):
+        """Перенести данные семьи в шард target.
+
+        Строки копируются со своими id, затем меняется запись в
+        family_shards и только потом данные удаляются из прежнего шарда:
+        прерванный перенос можно просто повторить.
+        """
+        source = self.shard_of_family(family_id)
+        if source == target:
+            return
+        with self._lock:
+            _copy_family(self.shards[source], shard_path(self.db_path, target), family_id, target)
+            self._set_placement(family_id, target)
+            _delete_family(self.shards[source], family_id, keep_directory=source == 0)
+        for shard in (self.shards[source], self.shards[target]):
+            shard._bump_version(family_id)
+
+
+def _prepare_shard(db, index):
+    """Шард без семьи из миграции прежней схемы и со своим диапазоном id.
+
+    Вызывается при каждом открытии: подготовленный шард узнается по
+    счетчикам AUTOINCREMENT в его диапазоне, поэтому подготовка,
+    прерванная сбоем сразу после создания файла, доделывается.
+    """
+    base = index * SHARD_ID_SPAN
+    conn = db._get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT name FROM sqlite_sequence WHERE seq >= ?', (base,))
+        prepared = {row[0] for row in cursor.fetchall()}
+        missing = [table for table in _SEQUENCE_TABLES if table not in prepared]
+        if not missing:
+            conn.rollback()
+            return
+        if not prepared:
+            # Шард еще не готовили: в файлах прежних версий в нем семья из миграции
+            cursor.execute('DELETE FROM weekly_templates')
+            cursor.execute('DELETE FROM members')
+            cursor.execute('DELETE FROM families')
+        # Иначе не хватает счетчиков таблиц, добавленных позже подготовки
+        for table in missing:
+            cursor.execute('DELETE FROM sqlite_sequence WHERE name = ?', (table,))
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, base))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _copy_family(source, target_path, family_id, target):
+    """Скопировать строки семьи из шарда source в файл target_path"""
+    conn = source._get_connection()
+    conn.execute('ATTACH DATABASE ? AS target', (target_path,))
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        children = 'SELECT id FROM main.members WHERE family_id = ?'
+
+        conn.execute(
+            'INSERT OR IGNORE INTO target.families (id, name, created_at) '
+            'SELECT id, name, created_at FROM main.families WHERE id = ?',
+            (family_id,)
+        )
+        # Пароли остаются только в основной базе; если семья возвращается
+        # в нее, там обновляются счетчики, а пароль не трогается
+        columns = [c for c in _columns(conn, "main", "members") if c != "password_hash"]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != "id")
+        conn.execute(
+            f'''INSERT INTO target.members ({", ".join(columns)})
+            SELECT {", ".join(columns)} FROM main.members WHERE family_id = ?
+            ON CONFLICT (id) DO UPDATE SET {updates}''',
+            (family_id,)
+        )
+        for table in _CHILD_TABLES:
+            columns = ", ".join(_columns(conn, "main", table))
+            conn.execute(
+                f'INSERT OR REPLACE INTO target.{table} ({columns}) '
+                f'SELECT {columns} FROM main.{table} WHERE child_id IN ({children})',
+                (family_id,)
+            )
+        conn.execute(
+            'INSERT OR REPLACE INTO target.weekly_seeds SELECT * FROM main.weekly_seeds WHERE family_id = ?',
+            (family_id,)
+        )
+        # Явные id двигают счетчик AUTOINCREMENT; возвращаем его в диапазон шарда
+        for table in _SEQUENCE_TABLES:
+            base = target * SHARD_ID_SPAN
+            conn.execute(
+                f'''UPDATE target.sqlite_sequence SET seq = (
+                    SELECT COALESCE(MAX(id), ?) FROM target.{table} WHERE id >= ? AND id < ?
+                ) WHERE name = ?''',
+                (base, base, base + SHARD_ID_SPAN, table)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute('DETACH DATABASE target')
+
+
+def _delete_family(db, family_id, keep_directory=False):
+    """Удалить данные семьи из шарда (keep_directory - оставить семью и
+    участников: в основной базе это справочник для входа и сессий)"""
+    conn = db._get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        children = 'SELECT id FROM members WHERE family_id = ?'
+        for table in _CHILD_TABLES:
+            conn.execute(f'DELETE FROM {table} WHERE child_id IN ({children})', (family_id,))
+        conn.execute('DELETE FROM weekly_seeds WHERE family_id = ?', (family_id,))
+        if not keep_directory:
+            conn.execute('DELETE FROM members WHERE family_id = ?', (family_id,))
+            conn.execute('DELETE FROM families WHERE id = ?', (family_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
@@ -1,16 +1,142 @@
 import asyncio
-from database import Database
+import heapq
+import logging
+from datetime import datetime, timedelta
 
-db = Database()
+import config
+from database import AsyncDatabase, Database, current_week
 
-async def reset_weekly_tasks():
-    """Обнулить еженедельные задания"""
-    db.delete_weekly_tasks()
-    print("✅ Еженедельные задания обновлены")
+logger = logging.getLogger(__name__)
 
-async def weekly_scheduler():
-    """Планировщик еженедельных заданий"""
-    while True:
-        await reset_weekly_tasks()
-        # Ждем 7 дней
-        await asyncio.sleep(7 * 24 * 60 * 60)
\ No newline at end of file
+# Дольше этого таймер не спит: перевод часов или сон машины
+# заметны не позже чем через столько секунд
+MAX_SLEEP = 60
+
+
+class Schedule:
+    """Расписание в духе cron: минута, час и (необязательно) день недели.
+
+    weekday - 0 (понедельник) ... 6 (воскресенье), None - каждый день.
+    Время локальное.
+    """
+
+    def __init__(self, minute=0, hour=0, weekday=None):
+        self.minute = minute
+        self.hour = hour
+        self.weekday = weekday
+
+    @classmethod
+    def parse(cls, spec):
+        """Разобрать строку cron "минута час * * день_недели".
+
+        Поддерживаются числа в минуте и часе, "*" или число (0 и 7 -
+        воскресенье) в дне недели; день месяца и месяц - только "*".
+        """
+        fields = spec.split()
+        if len(fields) != 5 or fields[2] != "*" or fields[3] != "*":
+            raise ValueError(f"Неподдерживаемое расписание: {spec!r}")
+        minute, hour, _, _, weekday = fields
+        weekday = None if weekday == "*" else (int(weekday) - 1) % 7
+        return cls(int(minute), int(hour), weekday)
+
+    def _at(self, day):
+        return day.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+
+    def previous(self, now):
+        """Последний момент расписания не позже now"""
+        at = self._at(now)
+        if at > now:
+            at -= timedelta(days=1)
+        while self.weekday is not None and at.weekday() != self.weekday:
+            at -= timedelta(days=1)
+        return at
+
+    def next(self, now):
+        """Первый момент расписания позже now"""
+        at = self._at(now)
+        if at <= now:
+            at += timedelta(days=1)
+        while self.weekday is not None and at.weekday() != self.weekday:
+            at += timedelta(days=1)
+        return at
+
+
+class Scheduler:
+    """Все периодические задачи бота на одном таймере.
+
+    Время последнего запуска каждой задачи хранится в scheduled_jobs:
+    после перезапуска пропущенный запуск выполняется сразу и один раз,
+    сколько бы их ни пропустили, а следующие считаются по расписанию,
+    а не от времени работы процесса. У новой задачи пропущенных нет:
+    отсчет идет от первого старта. Задачи - обычные функции от Database:
+    задача вызывается для каждого файла базы (шарда) в его потоке и не
+    блокирует цикл событий.
+    """
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self._jobs = []
+
+    def add(self, name, schedule: Schedule, func):
+        self._jobs.append((name, schedule, func))
+
+    async def _run_job(self, name, func, due):
+        try:
+            await self.db.run_on_shards(func)
+        except Exception:
+            # Время запуска не записываем: после перезапуска задача повторится
+            logger.exception(f"❌ Задача {name} завершилась ошибкой")
+            return
+        await self.db.set_job_last_run(name, due.timestamp())
+        logger.info(f"⏰ Задача {name} выполнена (по расписанию на {due:%Y-%m-%d %H:%M})")
+
+    async def run(self):
+        # Куча (время запуска, номер задачи): сверху всегда ближайшая
+        timers = []
+        now = datetime.now()
+        for index, (name, schedule, func) in enumerate(self._jobs):
+            last_run = await self.db.get_job_last_run(name)
+            if last_run is None:
+                # Новая задача (в том числе на новой установке) ничего не пропустила:
+                # первый запуск - по расписанию, а не сразу при старте бота
+                last_run = now.timestamp()
+                await self.db.set_job_last_run(name, last_run)
+            missed = schedule.previous(now)
+            due = missed if last_run < missed.timestamp() else schedule.next(now)
+            heapq.heappush(timers, (due, index))
+
+        while timers:
+            due, index = timers[0]
+            delay = (due - datetime.now()).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(min(delay, MAX_SLEEP))
+                continue
+
+            heapq.heappop(timers)
+            name, schedule, func = self._jobs[index]
+            await self._run_job(name, func, due)
+            heapq.heappush(timers, (schedule.next(max(due, datetime.now())), index))
+
+
+def reset_weekly_tasks(db: Database):
+    """Убрать невыполненные недельные задания прошлых недель и засеять текущую семьям шарда"""
+    week = current_week()
+    db.delete_weekly_tasks(keep_week=week)
+    # Каждая семья - своей короткой транзакцией; уже засеянные и семьи без шаблонов пропускаются
+    added = sum(db.seed_weekly_tasks(family_id, week) or 0 for family_id in db.get_local_family_ids())
+    logger.info(f"✅ Еженедельные задания обновлены ({db.db_path}, {week}, добавлено {added})")
+
+
+def archive_history(db: Database):
+    """Перенести старую историю шарда в архив и сжать его"""
+    tasks_moved, resets_moved = db.archive_history(keep_days=config.ARCHIVE_KEEP_DAYS)
+    db.compact()
+    logger.info(f"🗄 {db.db_path}: в архив перенесено заданий: {tasks_moved}, обнулений: {resets_moved}")
+
+
+def create_scheduler(db: AsyncDatabase):
+    """Планировщик со всеми задачами бота"""
+    scheduler = Scheduler(db)
+    scheduler.add("weekly_tasks", Schedule.parse(config.WEEKLY_TASKS_SCHEDULE), reset_weekly_tasks)
+    scheduler.add("archive_history", Schedule.parse(config.ARCHIVE_SCHEDULE), archive_history)
+    return scheduler
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import signal
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых апдейтов"""
+
+    def __init__(self, limit):
+        self._semaphore = asyncio.Semaphore(limit)
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        # Считаем апдейт до семафора: ждущий свободного места тоже уже принят
+        self._active += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self._active -= 1
+            if not self._active:
+                self._idle.set()
+
+    async def drain(self, timeout):
+        """Дождаться завершения принятых апдейтов, включая ждущие в очереди"""
+        # Фоновые задачи только что принятых апдейтов успевают дойти до счетчика
+        await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⏳ Не дождались {self._active} апдейтов при остановке")
+
+
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+
+def create_app(bot: Bot, dp: Dispatcher, path, secret_token=None, max_concurrency=100):
+    """aiohttp-приложение: POST path принимает апдейты, GET /health - проверка живости.
+
+    Для локальной проверки достаточно отправить JSON апдейта:
+    curl -X POST -H 'X-Telegram-Bot-Api-Secret-Token: <secret>' -d @update.json localhost:8080/webhook
+    """
+    limiter = ConcurrencyLimitMiddleware(max_concurrency)
+    dp.update.outer_middleware(limiter)
+
+    app = web.Application()
+    app["limiter"] = limiter
+    app.router.add_get("/health", health)
+    # Telegram получает 200 сразу, апдейт обрабатывается в фоне
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=True,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, base_url, path="/webhook", host="0.0.0.0", port=8080,
+                      secret_token=None, max_concurrency=100, max_connections=40, shutdown_timeout=30):
+    """Запустить webhook-сервер и работать до Ctrl+C или SIGTERM"""
+    app = create_app(bot, dp, path, secret_token=secret_token, max_concurrency=max_concurrency)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"🌐 Webhook-сервер слушает {host}:{port}{path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        # Windows: остается только Ctrl+C
+        pass
+
+    try:
+        await bot.set_webhook(
+            url=base_url.rstrip("/") + path,
+            secret_token=secret_token,
+            max_connections=max_connections,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("✅ Webhook установлен")
+        await stop.wait()
+    finally:
+        logger.info("⏹️  Остановка webhook-сервера")
+        # Сначала перестаем принимать апдейты, потом ждем начатые
+        await site.stop()
+        await app["limiter"].drain(shutdown_timeout)
+        try:
+            await bot.delete_webhook()
+        except Exception as e:
+            logger.warning(f"❌ Не удалось снять webhook: {e}")
+        await runner.cleanup()